@@ -2,12 +2,35 @@
 Configuration management for A-Patricia Agent
 """
 import os
-import json
-from typing import Optional
-from pydantic_settings import BaseSettings
+from dataclasses import dataclass, fields, MISSING
+from functools import lru_cache
+from typing import Optional, Tuple
 
+import orjson
+from dotenv import dotenv_values
 
-class Settings(BaseSettings):
+
+def _parse_bool(value: str) -> bool:
+    """Parse a boolean environment value (true/false, 1/0, yes/no, on/off)"""
+    return value.strip().lower() in ("1", "true", "t", "yes", "y", "on")
+
+
+def _upper_keys(values) -> dict:
+    """Upper-case variable names, letting an exact upper-case name win over other spellings"""
+    ordered = sorted(values.items(), key=lambda item: item[0].isupper())
+    return {key.upper(): value for key, value in ordered if value is not None}
+
+
+# Casters for the annotated field types (anything else is kept as str)
+_CASTERS = {
+    bool: _parse_bool,
+    int: int,
+    float: float,
+}
+
+
+@dataclass(frozen=True, slots=True, kw_only=True)
+class Settings:
     """Application settings loaded from environment variables"""
     
     # Application
@@ -25,43 +48,95 @@ class Settings(BaseSettings):
     GOOGLE_APPLICATION_CREDENTIALS_JSON: Optional[str] = None
     GEMINI_API_KEY: Optional[str] = None
     GEMINI_MODEL: str = "gemini-2.5-flash"
+    GEMINI_CONCURRENCY: int = 8  # Gemini calls running at once (dedicated threads)
     
     # Qdrant Configuration (Vector Database)
     QDRANT_HOST: str = "localhost"
     QDRANT_PORT: int = 6333
+    QDRANT_GRPC_PORT: int = 6334
+    QDRANT_PREFER_GRPC: bool = True
     QDRANT_COLLECTION: str = "products"
+    QDRANT_UPSERT_BATCH_SIZE: int = 64
+    QDRANT_UPSERT_CONCURRENCY: int = 4
     
     # Processing Configuration
     PRICE_TOLERANCE_PERCENT: float = 5.0
     MAX_PRODUCTS_PER_IMAGE: int = 100
     SEARCH_LIMIT: int = 5
     SIMILARITY_THRESHOLD: float = 0.7
+    SEARCH_CACHE_SIZE: int = 10000
+    SEARCH_CACHE_TTL: float = 60.0  # Seconds; bounds how long web-admin uploads/deletions go unseen
+    SEARCH_BATCH_WINDOW_MS: float = 10.0  # Concurrent searches within this window share one request
+    EMBEDDING_CACHE_SIZE: int = 4096
+    EMBEDDING_THREADS: int = 0  # 0 = torch default
+    VISION_MAX_IMAGE_SIDE: int = 1568  # Larger photos are downscaled before Gemini (0 = never)
+    VISION_CACHE_SIZE: int = 256  # Analyzed images kept in memory (0 disables the cache)
+    VISION_CACHE_TTL: float = 3600.0  # Seconds
     
     # Allowed Slack User IDs (empty = all users allowed)
     ALLOWED_USER_IDS: str = ""
     
-    class Config:
-        env_file = ".env"
-        extra = "ignore"
+    @classmethod
+    def from_env(cls, env_file: Optional[str] = ".env") -> "Settings":
+        """
+        Build settings from the process environment.
+        Values in `env_file` are used only when the variable is not already set.
+        Names are matched case-insensitively (like pydantic-settings).
+        """
+        env = {}
+        if env_file and os.path.isfile(env_file):
+            env.update(_upper_keys(dotenv_values(env_file)))
+        env.update(_upper_keys(os.environ))
+        
+        values = {}
+        missing = []
+        for field in fields(cls):
+            raw = env.get(field.name)
+            if raw is None:
+                if field.default is MISSING:
+                    missing.append(field.name)
+                continue
+            caster = _CASTERS.get(field.type, str)
+            try:
+                values[field.name] = caster(raw)
+            except ValueError:
+                raise ValueError(f"Invalid value for {field.name}: {raw!r}") from None
+        
+        if missing:
+            raise ValueError(f"Missing required settings: {', '.join(missing)}")
+        
+        return cls(**values)
     
     def get_gcp_credentials(self) -> Optional[dict]:
-        """Parse GCP credentials from JSON string"""
-        if self.GOOGLE_APPLICATION_CREDENTIALS_JSON:
-            try:
-                creds = json.loads(self.GOOGLE_APPLICATION_CREDENTIALS_JSON)
-                print(f"✅ GCP credentials loaded for project: {creds.get('project_id', 'unknown')}")
-                return creds
-            except json.JSONDecodeError as e:
-                print(f"❌ Error parsing GOOGLE_APPLICATION_CREDENTIALS_JSON: Invalid JSON format")
-                return None
-        print("⚠️ GOOGLE_APPLICATION_CREDENTIALS_JSON not set")
-        return None
+        """Parse GCP credentials from JSON string (parsed once, then cached)"""
+        return _parse_gcp_credentials(self.GOOGLE_APPLICATION_CREDENTIALS_JSON)
     
-    def get_allowed_users(self) -> list:
-        """Get list of allowed Slack user IDs"""
-        if not self.ALLOWED_USER_IDS:
-            return []
-        return [uid.strip() for uid in self.ALLOWED_USER_IDS.split(",") if uid.strip()]
+    def get_allowed_users(self) -> Tuple[str, ...]:
+        """Get allowed Slack user IDs (parsed once, then cached)"""
+        return _parse_allowed_users(self.ALLOWED_USER_IDS)
+
+
+@lru_cache(maxsize=None)
+def _parse_gcp_credentials(raw: Optional[str]) -> Optional[dict]:
+    """Parse GCP credentials from JSON string"""
+    if raw:
+        try:
+            creds = orjson.loads(raw)
+            print(f"✅ GCP credentials loaded for project: {creds.get('project_id', 'unknown')}")
+            return creds
+        except orjson.JSONDecodeError:
+            print(f"❌ Error parsing GOOGLE_APPLICATION_CREDENTIALS_JSON: Invalid JSON format")
+            return None
+    print("⚠️ GOOGLE_APPLICATION_CREDENTIALS_JSON not set")
+    return None
+
+
+@lru_cache(maxsize=None)
+def _parse_allowed_users(raw: str) -> Tuple[str, ...]:
+    """Split the comma-separated list of allowed Slack user IDs"""
+    if not raw:
+        return ()
+    return tuple(uid.strip() for uid in raw.split(",") if uid.strip())
 
 
-settings = Settings()
+settings = Settings.from_env()
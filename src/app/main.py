@@ -15,6 +15,7 @@ import sys
 from contextlib import asynccontextmanager
 from typing import Optional
 
+import aiohttp
 from fastapi import FastAPI, Request, Response
 from slack_bolt.async_app import AsyncApp
 from slack_bolt.adapter.fastapi.async_handler import AsyncSlackRequestHandler
@@ -60,13 +61,20 @@ async def lifespan(app: FastAPI):
     logger.info("🚀 Starting A-Patricia Agent...")
     logger.info("=" * 60)
     
+    # Shared, pooled HTTP session for every Slack Web API call (otherwise
+    # slack-sdk opens a new session per request)
+    slack_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=100, limit_per_host=50, keepalive_timeout=75)
+    )
+    slack_app.client.session = slack_session
+    
     try:
-        # Initialize services
-        logger.info("Initializing Vision Service (Gemini)...")
-        vision_service = VisionService()
-        
-        logger.info("Initializing Qdrant Service (Vector Database)...")
-        qdrant_service = QdrantService()
+        # Initialize independent services concurrently
+        logger.info("Initializing Vision Service (Gemini) and Qdrant Service (Vector Database)...")
+        vision_service, qdrant_service = await asyncio.gather(
+            VisionService.create(),
+            QdrantService.create()
+        )
         
         logger.info("Initializing Price Validator...")
         price_validator = PriceValidator(qdrant_service)
@@ -99,9 +107,15 @@ async def lifespan(app: FastAPI):
         
     except Exception as e:
         logger.error(f"❌ Failed to initialize services: {e}", exc_info=True)
+        await slack_session.close()
         raise
     
     logger.info("👋 Shutting down A-Patricia Agent...")
+    await slack_session.close()
+    if vision_service is not None:
+        await vision_service.close()
+    if qdrant_service is not None:
+        await qdrant_service.close()
 
 
 async def start_socket_mode():
@@ -1,9 +1,23 @@
 """Services module"""
-from app.services.vision import VisionService
-from app.services.qdrant_service import QdrantService
-from app.services.embedding_service import EmbeddingService
-from app.services.price_validator import PriceValidator
-from app.services.slack_handler import SlackHandler
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from app.services.vision import VisionService
+    from app.services.qdrant_service import QdrantService
+    from app.services.embedding_service import EmbeddingService
+    from app.services.price_validator import PriceValidator
+    from app.services.slack_handler import SlackHandler
+
+# Services are imported on first access so that importing one of them
+# does not pull in the dependencies (Gemini, Slack, torch) of the others
+_SERVICE_MODULES = {
+    "VisionService": "app.services.vision",
+    "QdrantService": "app.services.qdrant_service",
+    "EmbeddingService": "app.services.embedding_service",
+    "PriceValidator": "app.services.price_validator",
+    "SlackHandler": "app.services.slack_handler",
+}
 
 __all__ = [
     "VisionService", 
@@ -12,3 +26,9 @@ __all__ = [
     "PriceValidator", 
     "SlackHandler"
 ]
+
+
+def __getattr__(name: str):
+    if name in _SERVICE_MODULES:
+        return getattr(importlib.import_module(_SERVICE_MODULES[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
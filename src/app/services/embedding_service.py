@@ -3,21 +3,37 @@ Embedding service using sentence-transformers for semantic search.
 Generates vector embeddings for product names to enable fuzzy matching.
 """
 import logging
-from typing import List, Optional
+import re
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Optional
 import numpy as np
 
+from app.config import settings
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
 logger = logging.getLogger(__name__)
 
 # Lazy load to avoid loading model on import
 _model = None
 _model_name = "paraphrase-multilingual-MiniLM-L12-v2"
 
+# Collapses any run of whitespace into a single space
+_WS_RE = re.compile(r"\s+")
 
-def get_model():
-    """Lazy load the embedding model"""
+
+def get_model() -> "SentenceTransformer":
+    """Lazy load the embedding model (sentence-transformers is imported on first use)"""
     global _model
     if _model is None:
+        import torch
         from sentence_transformers import SentenceTransformer
+        
+        # Pin intra-op threads so the encoder doesn't oversubscribe the CPU
+        if settings.EMBEDDING_THREADS > 0:
+            torch.set_num_threads(settings.EMBEDDING_THREADS)
+        
         logger.info(f"Loading embedding model: {_model_name}")
         _model = SentenceTransformer(_model_name)
         logger.info("✅ Embedding model loaded successfully")
@@ -30,13 +46,25 @@ class EmbeddingService:
     Uses multilingual model for Spanish product names.
     """
     
-    def __init__(self):
-        """Initialize embedding service"""
+    def __init__(self, cache_size: int = settings.EMBEDDING_CACHE_SIZE):
+        """
+        Initialize embedding service.
+        
+        Args:
+            cache_size: Max embeddings kept in the LRU cache (0 disables it)
+        """
         self.model = get_model()
         self.embedding_dim = self.model.get_sentence_embedding_dimension()
-        logger.info(f"✅ EmbeddingService initialized (dim={self.embedding_dim})")
+        
+        # LRU cache: normalized text -> read-only embedding
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_hits = 0
+        self._cache_misses = 0
+        
+        logger.info(f"✅ EmbeddingService initialized (dim={self.embedding_dim}, cache={cache_size})")
     
-    def generate_embedding(self, text: str) -> List[float]:
+    def generate_embedding(self, text: str) -> np.ndarray:
         """
         Generate embedding vector for a single text.
         
@@ -44,19 +72,22 @@ class EmbeddingService:
             text: Text to embed (product name, description, etc.)
             
         Returns:
-            List of floats representing the embedding vector
+            L2-normalized float32 embedding vector
         """
         if not text or not text.strip():
-            return [0.0] * self.embedding_dim
+            return np.zeros(self.embedding_dim, dtype=np.float32)
         
         # Normalize text
         text = self._normalize_text(text)
         
-        # Generate embedding
-        embedding = self.model.encode(text, convert_to_numpy=True)
-        return embedding.tolist()
+        embedding = self._cache_get(text)
+        if embedding is None:
+            # Generate embedding (unit length, so cosine == dot product)
+            embedding = self._encode(text)
+            embedding = self._cache_put(text, embedding)
+        return embedding
     
-    def generate_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
+    def generate_embeddings_batch(self, texts: List[str]) -> np.ndarray:
         """
         Generate embeddings for multiple texts in batch (more efficient).
         
@@ -64,17 +95,81 @@ class EmbeddingService:
             texts: List of texts to embed
             
         Returns:
-            List of embedding vectors
+            float32 array of shape (len(texts), embedding_dim)
         """
         if not texts:
-            return []
+            return np.empty((0, self.embedding_dim), dtype=np.float32)
         
         # Normalize all texts
         normalized = [self._normalize_text(t) for t in texts]
         
-        # Generate embeddings in batch
-        embeddings = self.model.encode(normalized, convert_to_numpy=True, show_progress_bar=False)
-        return embeddings.tolist()
+        # Serve repeated names from cache; collect the rest (deduplicated)
+        embeddings = np.empty((len(normalized), self.embedding_dim), dtype=np.float32)
+        missing: Dict[str, List[int]] = {}
+        for i, text in enumerate(normalized):
+            cached = self._cache_get(text)
+            if cached is None:
+                missing.setdefault(text, []).append(i)
+            else:
+                embeddings[i] = cached
+        
+        # Generate embeddings in batch for cache misses only
+        if missing:
+            new_texts = list(missing)
+            encoded = self._encode(new_texts)
+            for text, embedding in zip(new_texts, encoded):
+                embeddings[missing[text]] = embedding
+                self._cache_put(text, embedding.copy())
+        
+        return embeddings
+    
+    def _encode(self, texts):
+        """
+        Run the model on already-normalized text(s).
+        Uses inference mode to skip autograd bookkeeping, then L2-normalizes
+        the float32 output in place (the collection uses dot product).
+        """
+        import torch
+        
+        with torch.inference_mode():
+            embeddings = self.model.encode(
+                texts,
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+        
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+        embeddings /= np.maximum(norms, 1e-12)
+        return embeddings
+    
+    def _cache_get(self, key: str) -> Optional[np.ndarray]:
+        """Look up a cached embedding and mark it as recently used"""
+        embedding = self._cache.get(key)
+        if embedding is not None:
+            self._cache.move_to_end(key)
+            self._cache_hits += 1
+        else:
+            self._cache_misses += 1
+        return embedding
+    
+    def _cache_put(self, key: str, embedding: np.ndarray) -> np.ndarray:
+        """Store an embedding (read-only, shared) and evict the oldest entry if full"""
+        embedding.setflags(write=False)
+        if self._cache_size > 0:
+            self._cache[key] = embedding
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return embedding
+    
+    def cache_info(self) -> Dict[str, int]:
+        """Get embedding cache statistics (hits, misses, current and max size)"""
+        return {
+            "hits": self._cache_hits,
+            "misses": self._cache_misses,
+            "size": len(self._cache),
+            "maxsize": self._cache_size
+        }
     
     def _normalize_text(self, text: str) -> str:
         """
@@ -89,34 +184,38 @@ class EmbeddingService:
         if not text:
             return ""
         
-        # Convert to uppercase (consistency with product names)
-        text = text.upper().strip()
-        
-        # Remove extra whitespace
-        text = " ".join(text.split())
-        
-        return text
+        # Collapse whitespace and uppercase (consistency with product names)
+        return _WS_RE.sub(" ", text).strip().upper()
     
-    def compute_similarity(self, embedding1: List[float], embedding2: List[float]) -> float:
+    def compute_similarity(self, embedding1: np.ndarray, embedding2: np.ndarray) -> float:
         """
         Compute cosine similarity between two embeddings.
         
+        Embeddings produced by this service are L2-normalized, so cosine
+        similarity reduces to a single dot product.
+        
         Args:
-            embedding1: First embedding vector
-            embedding2: Second embedding vector
+            embedding1: First (normalized) embedding vector
+            embedding2: Second (normalized) embedding vector
             
         Returns:
-            Similarity score between 0 and 1
+            Similarity score between -1 and 1
         """
-        vec1 = np.array(embedding1)
-        vec2 = np.array(embedding2)
-        
-        # Cosine similarity
-        dot_product = np.dot(vec1, vec2)
-        norm1 = np.linalg.norm(vec1)
-        norm2 = np.linalg.norm(vec2)
-        
-        if norm1 == 0 or norm2 == 0:
-            return 0.0
+        vec1 = np.asarray(embedding1, dtype=np.float32)
+        vec2 = np.asarray(embedding2, dtype=np.float32)
+        return float(np.dot(vec1, vec2))
+    
+    def compute_similarity_batch(self, query_embedding: np.ndarray, embeddings: np.ndarray) -> np.ndarray:
+        """
+        Compute cosine similarity between a query and many embeddings at once.
         
-        return float(dot_product / (norm1 * norm2))
+        Args:
+            query_embedding: Normalized query vector of shape (dim,)
+            embeddings: Normalized matrix of shape (n, dim)
+            
+        Returns:
+            Array of n similarity scores
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        return matrix @ query
@@ -3,17 +3,37 @@ Price validation service.
 Compares prices extracted from shelf images against database prices.
 Uses Qdrant vector database for semantic fuzzy matching.
 """
+from __future__ import annotations
+
 import logging
-from typing import List, Dict, Any, Optional
-from dataclasses import dataclass
+import math
+from collections import Counter
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Tuple
+from dataclasses import dataclass, field
+
+import numpy as np
 
 from app.config import settings
-from app.services.qdrant_service import QdrantService, ProductMatch
+
+if TYPE_CHECKING:
+    from app.services.qdrant_service import QdrantService
 
 logger = logging.getLogger(__name__)
 
+# Column layout of the Slack results table (#, producto, precio foto, precio sistema, validacion)
+_ROW_FMT = "{:<4} {:<45} {:>12} {:>15} {:>11}".format
+_TABLE_HEADER = _ROW_FMT("#", "PRODUCTO", "PRECIO FOTO", "PRECIO SISTEMA", "VALIDACION")
+
+# Slack icon for each validation status
+_STATUS_ICONS = {
+    "MATCH": "✅",
+    "PRICE_DIFF": "❌",
+    "NOT_FOUND": "⚠️",
+    "NO_PRICE": "⚠️",
+}
+
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ValidationResult:
     """Result of price validation for a single product"""
     producto_imagen: str       # Product name from image
@@ -24,6 +44,12 @@ class ValidationResult:
     diferencia: Optional[float]  # Price difference
     status: str                # MATCH, PRICE_DIFF, NOT_FOUND, NO_PRICE
     match_score: Optional[float] = None  # Similarity score (0-1)
+    dedup_key: str = field(init=False, repr=False, compare=False)  # Normalized name for dedup
+    
+    def __post_init__(self):
+        # Use sistema name if available, otherwise imagen name
+        key = self.producto_sistema or self.producto_imagen or ""
+        object.__setattr__(self, "dedup_key", key.upper().strip())
 
 
 class PriceValidator:
@@ -59,61 +85,63 @@ class PriceValidator:
         Returns:
             List of ValidationResult for each product
         """
-        logger.info(f"🔍 Validating {len(productos_imagen)} products for store {tienda_id}")
-        
-        validaciones = []
+        logger.info("🔍 Validating %d products for store %s", len(productos_imagen), tienda_id)
         
-        # Extract product names for batch search
-        queries = [p.get("nombre", "") for p in productos_imagen]
+        # Extract product names for batch search (blank names can't match anything)
+        valid_idx = [
+            i for i, p in enumerate(productos_imagen) if (p.get("nombre") or "").strip()
+        ]
+        queries = [productos_imagen[i]["nombre"] for i in valid_idx]
         
         # Batch search in Qdrant
-        search_results = await self.qdrant.search_products_batch(
-            queries=queries,
-            tienda_id=str(tienda_id),
-            limit=self.search_limit,
-            score_threshold=self.similarity_threshold
+        search_results = []
+        if queries:
+            search_results = await self.qdrant.search_products_batch(
+                queries=queries,
+                tienda_id=str(tienda_id),
+                limit=self.search_limit,
+                score_threshold=self.similarity_threshold
+            )
+        
+        # Best match per product: highest similarity score, None when not found
+        best_matches = [None] * len(productos_imagen)
+        for i, matches in zip(valid_idx, search_results):
+            if matches:
+                best_matches[i] = matches[0]
+        
+        # Compare all prices in one vectorized pass (NaN = missing price)
+        precios_imagen = np.array(
+            [p.get("precio") for p in productos_imagen], dtype=np.float64
+        )
+        precios_sistema = np.array(
+            [m.precio if m is not None else None for m in best_matches], dtype=np.float64
         )
+        diferencias, coinciden = self._compare_prices(precios_imagen, precios_sistema)
         
-        for producto in productos_imagen:
-            nombre_imagen = producto.get("nombre", "DESCONOCIDO")
-            precio_imagen = producto.get("precio")
-            
-            # Get matches for this product
-            matches = search_results.get(nombre_imagen, [])
-            
-            if not matches:
-                # Product not found in database
-                validaciones.append(ValidationResult(
-                    producto_imagen=nombre_imagen,
-                    precio_imagen=precio_imagen,
-                    producto_sistema=None,
-                    precio_sistema=None,
-                    validacion="⚠️",
-                    diferencia=None,
-                    status="NOT_FOUND",
-                    match_score=None
-                ))
-                continue
-            
-            # Use best match (highest similarity score)
-            best_match = matches[0]
-            precio_sistema = best_match.precio
-            nombre_sistema = best_match.nombre
-            match_score = best_match.score
-            
-            # Compare prices
-            validation_result = self._compare_prices(precio_imagen, precio_sistema)
-            
-            validaciones.append(ValidationResult(
-                producto_imagen=nombre_imagen,
-                precio_imagen=precio_imagen,
-                producto_sistema=nombre_sistema,
-                precio_sistema=precio_sistema,
-                validacion=validation_result["validacion"],
-                diferencia=validation_result["diferencia"],
-                status=validation_result["status"],
-                match_score=match_score
-            ))
+        # Status per product, decided with array ops (first matching condition wins)
+        encontrados = np.array([m is not None for m in best_matches], dtype=bool)
+        statuses = np.select(
+            [~encontrados, np.isnan(diferencias), coinciden],
+            ["NOT_FOUND", "NO_PRICE", "MATCH"],
+            default="PRICE_DIFF"
+        ).tolist()
+        
+        # NaN difference means not found / no price -> reported as None
+        validaciones = [
+            ValidationResult(
+                producto_imagen=producto.get("nombre", "DESCONOCIDO"),
+                precio_imagen=producto.get("precio"),
+                producto_sistema=match.nombre if match is not None else None,
+                precio_sistema=match.precio if match is not None else None,
+                validacion=_STATUS_ICONS[status],
+                diferencia=None if math.isnan(diferencia) else diferencia,
+                status=status,
+                match_score=match.score if match is not None else None
+            )
+            for producto, match, status, diferencia in zip(
+                productos_imagen, best_matches, statuses, diferencias.tolist()
+            )
+        ]
         
         # Log summary
         self._log_summary(validaciones)
@@ -121,55 +149,49 @@ class PriceValidator:
         return validaciones
     
     def _compare_prices(
-        self, 
-        precio_imagen: Optional[float], 
-        precio_sistema: Optional[float]
-    ) -> Dict[str, Any]:
-        """Compare two prices and return validation result"""
-        
-        if precio_imagen is None or precio_sistema is None:
-            return {
-                "validacion": "⚠️",
-                "diferencia": None,
-                "status": "NO_PRICE"
-            }
-        
-        diferencia = precio_sistema - precio_imagen
+        self,
+        precios_imagen: np.ndarray,
+        precios_sistema: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Compare image prices against system prices for all products at once.
         
-        if self._prices_match(precio_imagen, precio_sistema):
-            return {
-                "validacion": "✅",
-                "diferencia": diferencia,
-                "status": "MATCH"
-            }
-        else:
-            return {
-                "validacion": "❌",
-                "diferencia": diferencia,
-                "status": "PRICE_DIFF"
-            }
-    
-    def _prices_match(self, precio_imagen: float, precio_sistema: float) -> bool:
-        """Check if prices match within tolerance"""
-        if precio_sistema == 0:
-            return precio_imagen == 0
+        Args:
+            precios_imagen: Prices seen in the image (NaN if unreadable)
+            precios_sistema: Prices in the database (NaN if not found)
+            
+        Returns:
+            Tuple of (differences sistema - imagen, boolean array of prices
+            matching within tolerance). Differences are NaN when either
+            price is missing.
+        """
+        diferencias = precios_sistema - precios_imagen
         
-        diff_percent = abs(precio_imagen - precio_sistema) / precio_sistema
-        return diff_percent <= self.tolerance
+        # A zero system price only matches a zero image price
+        with np.errstate(divide="ignore", invalid="ignore"):
+            diff_percent = np.abs(diferencias) / precios_sistema
+        coinciden = np.where(
+            precios_sistema == 0,
+            precios_imagen == 0,
+            diff_percent <= self.tolerance
+        )
+        return diferencias, coinciden
     
     def _log_summary(self, validaciones: List[ValidationResult]):
         """Log validation summary"""
-        matches = sum(1 for v in validaciones if v.status == "MATCH")
-        diffs = sum(1 for v in validaciones if v.status == "PRICE_DIFF")
-        not_found = sum(1 for v in validaciones if v.status == "NOT_FOUND")
-        no_price = sum(1 for v in validaciones if v.status == "NO_PRICE")
+        counts = Counter(v.status for v in validaciones)
+        matches = counts["MATCH"]
+        diffs = counts["PRICE_DIFF"]
+        not_found = counts["NOT_FOUND"]
+        no_price = counts["NO_PRICE"]
         
         logger.info(
-            f"📊 Validation complete: "
-            f"✅ {matches} correct | "
-            f"❌ {diffs} price diff | "
-            f"⚠️ {not_found} not found | "
-            f"❔ {no_price} no price"
+            "📊 Validation complete: "
+            "✅ %d correct | "
+            "❌ %d price diff | "
+            "⚠️ %d not found | "
+            "❔ %d no price",
+            matches, diffs, not_found, no_price
         )
     
     def _deduplicate_results(
@@ -184,9 +206,7 @@ class PriceValidator:
         unique = []
         
         for v in validaciones:
-            # Use sistema name if available, otherwise imagen name
-            key = v.producto_sistema if v.producto_sistema else v.producto_imagen
-            key = key.upper().strip() if key else ""
+            key = v.dedup_key
             
             # Skip empty or NULL names
             if not key or key == "NULL" or key == "NONE":
@@ -221,32 +241,28 @@ class PriceValidator:
             f"*Resultados de validación - Tienda {tienda_id}*",
             "",
             "```",
-            f"{'#':<4} {'PRODUCTO':<45} {'PRECIO FOTO':>12} {'PRECIO SISTEMA':>15} {'VALIDACION':>11}",
+            _TABLE_HEADER,
             "-" * 92
         ]
         
         for i, v in enumerate(validaciones, 1):
             # Usar nombre del sistema si está disponible, sino el de la imagen
-            nombre = v.producto_sistema if v.producto_sistema else v.producto_imagen
-            nombre = nombre[:44] if len(nombre) > 44 else nombre
+            nombre = (v.producto_sistema or v.producto_imagen)[:44]
             
             # Formatear precios
-            p_foto = f"${v.precio_imagen:.2f}" if v.precio_imagen is not None else "N/A"
-            p_sistema = f"${v.precio_sistema:.2f}" if v.precio_sistema is not None else "N/A"
+            p_foto = "$%.2f" % v.precio_imagen if v.precio_imagen is not None else "N/A"
+            p_sistema = "$%.2f" % v.precio_sistema if v.precio_sistema is not None else "N/A"
             
             # Validación: ✅ correcto, ❌ diferencia, ⚠️ no encontrado
-            val_symbol = v.validacion
-            
-            lines.append(
-                f"{i:<4} {nombre:<45} {p_foto:>12} {p_sistema:>15} {val_symbol:>11}"
-            )
+            lines.append(_ROW_FMT(i, nombre, p_foto, p_sistema, v.validacion))
         
         lines.append("```")
         
         # Resumen (basado en lista deduplicada)
-        matches = sum(1 for v in validaciones if v.status == "MATCH")
-        diffs = sum(1 for v in validaciones if v.status == "PRICE_DIFF")
-        not_found = sum(1 for v in validaciones if v.status in ("NOT_FOUND", "NO_PRICE"))
+        counts = Counter(v.status for v in validaciones)
+        matches = counts["MATCH"]
+        diffs = counts["PRICE_DIFF"]
+        not_found = counts["NOT_FOUND"] + counts["NO_PRICE"]
         total = len(validaciones)
         
         lines.append("")
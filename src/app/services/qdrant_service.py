@@ -2,21 +2,47 @@
 Qdrant service for vector database operations.
 Replaces BigQuery with semantic search capabilities.
 """
+import asyncio
 import logging
-from typing import List, Dict, Any, Optional
-from dataclasses import dataclass
+import uuid
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
+from dataclasses import dataclass, field, replace
 
-from qdrant_client import QdrantClient
+import numpy as np
+from cachetools import TTLCache
+from qdrant_client import AsyncQdrantClient
 from qdrant_client.http import models
-from qdrant_client.http.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue
+from qdrant_client.http.models import Distance, VectorParams, Filter, FieldCondition, MatchValue, SearchRequest
 
 from app.config import settings
 from app.services.embedding_service import EmbeddingService
 
 logger = logging.getLogger(__name__)
 
+# Keep the long-lived gRPC channel alive between requests instead of reconnecting
+_GRPC_OPTIONS = {
+    "grpc.keepalive_time_ms": 30000,
+    "grpc.keepalive_timeout_ms": 10000,
+    "grpc.http2.max_pings_without_data": 0,
+}
 
-@dataclass
+# Only the payload fields ProductMatch reads are sent back by searches
+_PAYLOAD_SELECTOR = models.PayloadSelectorInclude(
+    include=["nombre", "precio", "tienda_id", "codigo", "categoria", "presentacion"]
+)
+
+# Search the INT8 quantized vectors, then rescore the oversampled top candidates
+# with the original vectors so scores stay comparable to the similarity threshold
+_SEARCH_PARAMS = models.SearchParams(
+    quantization=models.QuantizationSearchParams(
+        ignore=False,
+        rescore=True,
+        oversampling=2.0
+    )
+)
+
+
+@dataclass(slots=True, frozen=True)
 class ProductMatch:
     """Represents a product match from vector search"""
     id: str
@@ -27,11 +53,46 @@ class ProductMatch:
     categoria: Optional[str] = None
     presentacion: Optional[str] = None
     score: float = 0.0
-    metadata: Dict[str, Any] = None
+    metadata: Dict[str, Any] = field(default_factory=dict, compare=False)  # Not part of eq/hash
+
+
+def _hit_to_match(hit: models.ScoredPoint) -> ProductMatch:
+    """Build a ProductMatch from a search hit (metadata shares the projected payload dict)"""
+    payload = hit.payload or {}
+    return ProductMatch(
+        id=str(hit.id),
+        nombre=payload.get("nombre", ""),
+        precio=float(payload.get("precio") or 0),
+        tienda_id=str(payload.get("tienda_id", "")),
+        codigo=payload.get("codigo"),
+        categoria=payload.get("categoria"),
+        presentacion=payload.get("presentacion"),
+        score=hit.score,
+        metadata=payload
+    )
+
+
+def rerank_matches(
+    matches: List[ProductMatch],
+    query_embedding: np.ndarray,
+    candidate_embeddings: np.ndarray
+) -> List[ProductMatch]:
+    """
+    Re-score matches client-side against their (normalized) vectors.
     
-    def __post_init__(self):
-        if self.metadata is None:
-            self.metadata = {}
+    Args:
+        matches: Matches to re-score
+        query_embedding: Normalized query vector of shape (dim,)
+        candidate_embeddings: Normalized vectors of `matches`, shape (n, dim)
+        
+    Returns:
+        New ProductMatch objects with updated scores, best first
+    """
+    # One float32 matrix-vector product (BLAS/SIMD) scores every candidate
+    query = np.asarray(query_embedding, dtype=np.float32)
+    scores = np.asarray(candidate_embeddings, dtype=np.float32) @ query
+    order = np.argsort(-scores, kind="stable")
+    return [replace(matches[i], score=float(scores[i])) for i in order]
 
 
 class QdrantService:
@@ -43,38 +104,106 @@ class QdrantService:
     COLLECTION_NAME = "products"
     
     def __init__(self):
-        """Initialize Qdrant client and embedding service"""
-        self.client = QdrantClient(
+        """
+        Initialize Qdrant client and embedding service.
+        Use `create()` to also make sure the collection exists.
+        """
+        self.client = AsyncQdrantClient(
             host=settings.QDRANT_HOST,
             port=settings.QDRANT_PORT,
+            grpc_port=settings.QDRANT_GRPC_PORT,
+            prefer_grpc=settings.QDRANT_PREFER_GRPC,
+            grpc_options=_GRPC_OPTIONS,
             timeout=30
         )
         self.embedding_service = EmbeddingService()
-        self._ensure_collection()
+        
+        # Store filters are immutable once built, so reuse them per tienda_id
+        self._filter_cache: Dict[str, Filter] = {}
+        
+        # Short-lived cache of search results; bumping a version invalidates
+        # the entries of a store (or of every store, for the global one).
+        # Only this process's writes bump versions: changes made by the web
+        # admin become visible when entries expire (SEARCH_CACHE_TTL)
+        self._search_cache: TTLCache = TTLCache(
+            maxsize=settings.SEARCH_CACHE_SIZE,
+            ttl=settings.SEARCH_CACHE_TTL
+        )
+        self._tienda_versions: Dict[str, int] = {}
+        self._global_version = 0
+        self._inflight: Dict[tuple, "asyncio.Future[List[ProductMatch]]"] = {}
+        
+        # Single searches waiting to be sent together (see _batched_search)
+        self._search_queue: List[Tuple["asyncio.Future[List[models.ScoredPoint]]", SearchRequest]] = []
+        self._flush_task: Optional["asyncio.Task[None]"] = None
         logger.info(f"✅ QdrantService initialized (host={settings.QDRANT_HOST}:{settings.QDRANT_PORT})")
     
-    def _ensure_collection(self):
+    @classmethod
+    async def create(cls) -> "QdrantService":
+        """
+        Build the service and ensure the collection exists.
+        Loading the embedding model is blocking, so it runs in a worker
+        thread to let startup overlap it with other services.
+        """
+        service = await asyncio.to_thread(cls)
+        await service._ensure_collection()
+        return service
+    
+    async def close(self):
+        """Close the underlying Qdrant connections"""
+        await self.client.close()
+    
+    def _filter_for_tienda(self, tienda_id: Optional[str]) -> Optional[Filter]:
+        """Get the (cached) filter restricting results to a store, None if no store"""
+        if not tienda_id:
+            return None
+        tienda_id = str(tienda_id)
+        search_filter = self._filter_cache.get(tienda_id)
+        if search_filter is None:
+            search_filter = Filter(
+                must=[
+                    FieldCondition(
+                        key="tienda_id",
+                        match=MatchValue(value=tienda_id)
+                    )
+                ]
+            )
+            self._filter_cache[tienda_id] = search_filter
+        return search_filter
+    
+    async def _ensure_collection(self):
         """Create collection if it doesn't exist"""
-        collections = self.client.get_collections().collections
+        collections = (await self.client.get_collections()).collections
         collection_names = [c.name for c in collections]
         
         if self.COLLECTION_NAME not in collection_names:
             logger.info(f"Creating collection: {self.COLLECTION_NAME}")
-            self.client.create_collection(
+            await self.client.create_collection(
                 collection_name=self.COLLECTION_NAME,
                 vectors_config=VectorParams(
                     size=self.embedding_service.embedding_dim,
-                    distance=Distance.COSINE
-                )
+                    distance=Distance.DOT,  # Vectors are L2-normalized, so dot == cosine
+                    on_disk=True  # Originals on disk, only read when rescoring
+                ),
+                # INT8 scalar quantization: ~4x less RAM for the index, originals kept for rescoring
+                quantization_config=models.ScalarQuantization(
+                    scalar=models.ScalarQuantizationConfig(
+                        type=models.ScalarType.INT8,
+                        quantile=0.99,
+                        always_ram=True
+                    )
+                ),
+                # Keep the HNSW graph in RAM for the ANN walk
+                hnsw_config=models.HnswConfigDiff(on_disk=False)
             )
             
             # Create payload indexes for filtering
-            self.client.create_payload_index(
+            await self.client.create_payload_index(
                 collection_name=self.COLLECTION_NAME,
                 field_name="tienda_id",
                 field_schema="keyword"
             )
-            self.client.create_payload_index(
+            await self.client.create_payload_index(
                 collection_name=self.COLLECTION_NAME,
                 field_name="file_id",
                 field_schema="keyword"
@@ -102,57 +231,127 @@ class QdrantService:
         Returns:
             List of ProductMatch objects sorted by similarity
         """
+        tienda_key = str(tienda_id) if tienda_id else ""
+        cache_key = (
+            " ".join(query.split()).upper(),
+            tienda_key,
+            limit,
+            round(score_threshold, 3),
+            self._global_version,
+            self._tienda_versions.get(tienda_key, 0)
+        )
+        cached = self._search_cache.get(cache_key)
+        if cached is not None:
+            logger.debug(f"Search '{query}' served from cache")
+            return list(cached)
+        
+        # Identical searches already in flight share a single Qdrant request
+        task = self._inflight.get(cache_key)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._search_uncached(query, tienda_id, limit, score_threshold, cache_key)
+            )
+            self._inflight[cache_key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(cache_key, None))
+        else:
+            logger.debug(f"Search '{query}' joined an in-flight request")
+        
+        # Shield so one cancelled caller doesn't cancel the search for the others
+        return list(await asyncio.shield(task))
+    
+    async def _search_uncached(
+        self,
+        query: str,
+        tienda_id: Optional[str],
+        limit: int,
+        score_threshold: float,
+        cache_key: tuple
+    ) -> List[ProductMatch]:
+        """Run a single search against Qdrant and cache the result"""
         # Generate embedding for query
         query_embedding = self.embedding_service.generate_embedding(query)
         
         # Build filter if tienda_id provided
-        search_filter = None
-        if tienda_id:
-            search_filter = Filter(
-                must=[
-                    FieldCondition(
-                        key="tienda_id",
-                        match=MatchValue(value=str(tienda_id))
-                    )
-                ]
-            )
+        search_filter = self._filter_for_tienda(tienda_id)
         
-        # Search in Qdrant
-        results = self.client.search(
-            collection_name=self.COLLECTION_NAME,
-            query_vector=query_embedding,
-            query_filter=search_filter,
+        # Search in Qdrant (batched with other searches arriving at the same time)
+        results = await self._batched_search(SearchRequest(
+            vector=query_embedding.tolist(),
+            filter=search_filter,
+            params=_SEARCH_PARAMS,
+            with_payload=_PAYLOAD_SELECTOR,
             limit=limit,
             score_threshold=score_threshold
-        )
+        ))
         
         # Convert to ProductMatch objects
-        matches = []
-        for hit in results:
-            payload = hit.payload or {}
-            match = ProductMatch(
-                id=str(hit.id),
-                nombre=payload.get("nombre", ""),
-                precio=float(payload.get("precio", 0)),
-                tienda_id=str(payload.get("tienda_id", "")),
-                codigo=payload.get("codigo"),
-                categoria=payload.get("categoria"),
-                presentacion=payload.get("presentacion"),
-                score=hit.score,
-                metadata=payload
-            )
-            matches.append(match)
+        matches = list(map(_hit_to_match, results))
+        
+        self._search_cache[cache_key] = matches
         
         logger.debug(f"Search '{query}' returned {len(matches)} results")
         return matches
     
+    async def _batched_search(self, request: SearchRequest) -> List[models.ScoredPoint]:
+        """
+        Queue a search request and wait for its hits.
+        Requests queued within SEARCH_BATCH_WINDOW_MS go to Qdrant as one search_batch call.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._search_queue.append((future, request))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_search_queue())
+            self._flush_task.add_done_callback(self._on_flush_done)
+        return await future
+    
+    def _on_flush_done(self, task: "asyncio.Task[None]"):
+        """Cancel the waiters of a flush that was cancelled before it took the queue"""
+        if task.cancelled() and self._flush_task is task:
+            queue, self._search_queue = self._search_queue, []
+            self._flush_task = None
+            for future, _ in queue:
+                future.cancel()
+    
+    async def _flush_search_queue(self):
+        """
+        Send every queued search request in a single batch and resolve the waiters.
+        No waiter is left pending: on cancellation they are cancelled too, and
+        the next queued request schedules a new flush.
+        """
+        queue = []
+        try:
+            try:
+                await asyncio.sleep(settings.SEARCH_BATCH_WINDOW_MS / 1000)
+            finally:
+                queue, self._search_queue = self._search_queue, []
+                self._flush_task = None
+            
+            hits_per_query = await self.client.search_batch(
+                collection_name=self.COLLECTION_NAME,
+                requests=[request for _, request in queue]
+            )
+        except Exception as e:
+            for future, _ in queue:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        except BaseException:
+            for future, _ in queue:
+                future.cancel()
+            raise
+        
+        logger.debug(f"Flushed {len(queue)} queued searches in one batch")
+        for (future, _), hits in zip(queue, hits_per_query):
+            if not future.done():
+                future.set_result(hits)
+    
     async def search_products_batch(
         self,
         queries: List[str],
         tienda_id: Optional[str] = None,
         limit: int = 3,
         score_threshold: float = 0.5
-    ) -> Dict[str, List[ProductMatch]]:
+    ) -> List[List[ProductMatch]]:
         """
         Search for multiple products in batch.
         
@@ -163,59 +362,43 @@ class QdrantService:
             score_threshold: Minimum similarity score
             
         Returns:
-            Dictionary mapping query -> list of matches
+            List of matches per query, aligned with `queries` by index
+            (duplicate names each get their own entry)
         """
-        results = {}
-        
         # Generate all embeddings in batch
         embeddings = self.embedding_service.generate_embeddings_batch(queries)
+        logger.debug(
+            "Embedding cache: %(hits)d hits, %(misses)d misses (%(size)d/%(maxsize)d entries)",
+            self.embedding_service.cache_info()
+        )
         
         # Build filter
-        search_filter = None
-        if tienda_id:
-            search_filter = Filter(
-                must=[
-                    FieldCondition(
-                        key="tienda_id",
-                        match=MatchValue(value=str(tienda_id))
-                    )
-                ]
-            )
+        search_filter = self._filter_for_tienda(tienda_id)
         
-        # Search for each query
-        for query, embedding in zip(queries, embeddings):
-            hits = self.client.search(
-                collection_name=self.COLLECTION_NAME,
-                query_vector=embedding,
-                query_filter=search_filter,
+        # Search all queries in a single request (Qdrant runs them in parallel)
+        requests = [
+            SearchRequest(
+                vector=embedding.tolist(),
+                filter=search_filter,
+                params=_SEARCH_PARAMS,
                 limit=limit,
-                score_threshold=score_threshold
+                score_threshold=score_threshold,
+                with_payload=_PAYLOAD_SELECTOR
             )
-            
-            matches = []
-            for hit in hits:
-                payload = hit.payload or {}
-                match = ProductMatch(
-                    id=str(hit.id),
-                    nombre=payload.get("nombre", ""),
-                    precio=float(payload.get("precio", 0)),
-                    tienda_id=str(payload.get("tienda_id", "")),
-                    codigo=payload.get("codigo"),
-                    categoria=payload.get("categoria"),
-                    presentacion=payload.get("presentacion"),
-                    score=hit.score,
-                    metadata=payload
-                )
-                matches.append(match)
-            
-            results[query] = matches
+            for embedding in embeddings
+        ]
+        hits_per_query = await self.client.search_batch(
+            collection_name=self.COLLECTION_NAME,
+            requests=requests
+        )
         
-        return results
+        return [list(map(_hit_to_match, hits)) for hits in hits_per_query]
     
     async def add_products(
         self,
         products: List[Dict[str, Any]],
-        file_id: str
+        file_id: str,
+        batch_size: Optional[int] = None
     ) -> int:
         """
         Add products to the vector database.
@@ -229,6 +412,7 @@ class QdrantService:
                 - categoria: Category (optional)
                 - presentacion: Size/presentation (optional)
             file_id: ID of the source file for tracking
+            batch_size: Points per upsert request (default: QDRANT_UPSERT_BATCH_SIZE)
             
         Returns:
             Number of products added
@@ -237,17 +421,15 @@ class QdrantService:
             return 0
         
         # Extract names for batch embedding
+        # (EmbeddingService returns unit-length vectors, as the DOT collection requires)
         names = [p.get("nombre", "") for p in products]
         embeddings = self.embedding_service.generate_embeddings_batch(names)
         
-        # Create points
-        points = []
-        for i, (product, embedding) in enumerate(zip(products, embeddings)):
-            # Generate unique ID
-            point_id = f"{file_id}_{i}"
-            
-            # Build payload
-            payload = {
+        # Build the upsert columns (ids, vectors, payloads) in one pass each
+        # Deterministic UUID per (file, row): Qdrant only accepts uint or UUID ids
+        ids = [str(uuid.uuid5(uuid.NAMESPACE_URL, f"{file_id}/{i}")) for i in range(len(products))]
+        payloads = [
+            {
                 "nombre": product.get("nombre", ""),
                 "precio": float(product.get("precio", 0)),
                 "tienda_id": str(product.get("tienda_id", "")),
@@ -256,50 +438,47 @@ class QdrantService:
                 "presentacion": product.get("presentacion"),
                 "file_id": file_id
             }
-            
-            points.append(PointStruct(
-                id=point_id,
-                vector=embedding,
-                payload=payload
-            ))
-        
-        # Upsert in batches
-        batch_size = 100
-        for i in range(0, len(points), batch_size):
-            batch = points[i:i + batch_size]
-            self.client.upsert(
-                collection_name=self.COLLECTION_NAME,
-                points=batch
-            )
+            for product in products
+        ]
         
-        logger.info(f"Added {len(points)} products from file {file_id}")
-        return len(points)
+        # Upsert in batches (column slices), several in flight at once
+        semaphore = asyncio.Semaphore(settings.QDRANT_UPSERT_CONCURRENCY)
+        
+        async def _upsert(start: int, end: int):
+            async with semaphore:
+                await self.client.upsert(
+                    collection_name=self.COLLECTION_NAME,
+                    points=models.Batch(
+                        ids=ids[start:end],
+                        vectors=embeddings[start:end].tolist(),
+                        payloads=payloads[start:end]
+                    ),
+                    wait=False
+                )
+        
+        batch_size = batch_size or settings.QDRANT_UPSERT_BATCH_SIZE
+        await asyncio.gather(*(
+            _upsert(i, i + batch_size)
+            for i in range(0, len(ids), batch_size)
+        ))
+        
+        # Cached searches of the affected stores (and unfiltered ones) are stale now
+        tiendas = {payload["tienda_id"] for payload in payloads}
+        for tienda_id in tiendas | {""}:
+            self._tienda_versions[tienda_id] = self._tienda_versions.get(tienda_id, 0) + 1
+        
+        logger.info(f"Added {len(ids)} products from file {file_id}")
+        return len(ids)
     
-    async def delete_by_file(self, file_id: str) -> int:
+    async def delete_by_file(self, file_id: str) -> None:
         """
         Delete all products from a specific file.
+        Issues a single delete request (no count round trip beforehand).
         
         Args:
             file_id: ID of the file whose products should be deleted
-            
-        Returns:
-            Number of points deleted
         """
-        # Count before delete
-        count_before = self.client.count(
-            collection_name=self.COLLECTION_NAME,
-            count_filter=Filter(
-                must=[
-                    FieldCondition(
-                        key="file_id",
-                        match=MatchValue(value=file_id)
-                    )
-                ]
-            )
-        ).count
-        
-        # Delete points
-        self.client.delete(
+        await self.client.delete(
             collection_name=self.COLLECTION_NAME,
             points_selector=models.FilterSelector(
                 filter=Filter(
@@ -313,42 +492,70 @@ class QdrantService:
             )
         )
         
-        logger.info(f"Deleted {count_before} products from file {file_id}")
-        return count_before
+        # The file may span several stores: invalidate every cached search
+        self._global_version += 1
+        
+        logger.info(f"Deleted products from file {file_id}")
     
     async def get_collection_stats(self) -> Dict[str, Any]:
         """Get statistics about the collection"""
-        info = self.client.get_collection(self.COLLECTION_NAME)
+        info = await self.client.get_collection(self.COLLECTION_NAME)
         return {
             "total_points": info.points_count,
             "vectors_count": info.vectors_count,
             "status": info.status.value
         }
     
-    async def get_products_by_tienda(self, tienda_id: str, limit: int = 1000) -> List[Dict[str, Any]]:
+    async def iter_products_by_tienda(
+        self,
+        tienda_id: str,
+        page_size: int = 256
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Iterate over all products of a store, one scroll page at a time.
+        
+        Args:
+            tienda_id: Store ID
+            page_size: Points fetched per scroll request
+            
+        Yields:
+            Product dictionaries (point payloads)
+        """
+        scroll_filter = self._filter_for_tienda(tienda_id)
+        
+        offset = None
+        while True:
+            results, offset = await self.client.scroll(
+                collection_name=self.COLLECTION_NAME,
+                scroll_filter=scroll_filter,
+                limit=page_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False
+            )
+            for point in results:
+                yield point.payload
+            if offset is None:
+                break
+    
+    async def get_products_by_tienda(
+        self,
+        tienda_id: str,
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
         """
         Get all products for a specific store.
         
         Args:
             tienda_id: Store ID
-            limit: Maximum products to return
+            limit: Maximum products to return (None = all)
             
         Returns:
             List of product dictionaries
         """
-        results, _ = self.client.scroll(
-            collection_name=self.COLLECTION_NAME,
-            scroll_filter=Filter(
-                must=[
-                    FieldCondition(
-                        key="tienda_id",
-                        match=MatchValue(value=str(tienda_id))
-                    )
-                ]
-            ),
-            limit=limit,
-            with_payload=True,
-            with_vectors=False
-        )
-        
-        return [point.payload for point in results]
+        products = []
+        async for payload in self.iter_products_by_tienda(tienda_id):
+            if limit is not None and len(products) >= limit:
+                break
+            products.append(payload)
+        return products
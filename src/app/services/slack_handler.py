@@ -6,7 +6,8 @@ Uses Qdrant for semantic product search.
 import asyncio
 import logging
 import re
-from typing import Optional, Set
+from collections import OrderedDict
+from typing import Optional
 
 from slack_bolt.async_app import AsyncApp
 from slack_sdk.web.async_client import AsyncWebClient
@@ -17,15 +18,114 @@ from app.services.price_validator import PriceValidator
 
 logger = logging.getLogger(__name__)
 
+# Patrones de tienda en orden de especificidad
+_TIENDA_PATTERNS = tuple(re.compile(p) for p in (
+    r'tienda\s*[#:]?\s*(\d+)',      # "tienda 810", "tienda: 810", "tienda #810"
+    r'store\s*[#:]?\s*(\d+)',        # "store 810"
+    r'sucursal\s*[#:]?\s*(\d+)',     # "sucursal 810"
+    r'#(\d{3,4})\b',                 # "#810"
+    r'\b(\d{3,4})\b'                 # Standalone 3-4 digit number as fallback
+))
+# Todos los patrones requieren un dígito: sin dígitos no hay tienda
+_DIGIT_RE = re.compile(r'\d')
+
+# Limpieza del término de búsqueda
+_MENTION_RE = re.compile(r'<@[A-Z0-9]+>')
+
+# Referencias a tienda y frases comunes de solicitud, fusionadas en una sola
+# alternancia (se prueban en orden: de más específico a menos)
+_CLEANUP_RE = re.compile('|'.join(f'(?:{p})' for p in (
+    r'(de\s+la\s+)?tienda\s*[#:]?\s*\d+',
+    r'(de\s+la\s+)?store\s*[#:]?\s*\d+',
+    r'(de\s+la\s+)?sucursal\s*[#:]?\s*\d+',
+    r'#\d+',
+    r'tr[aá]eme\s+el\s+precio\s+de\s+(la|el|los|las)?\s*',
+    r'cu[aá]l\s+es\s+el\s+precio\s+de\s+(la|el|los|las)?\s*',
+    r'dame\s+el\s+precio\s+de\s+(la|el|los|las)?\s*',
+    r'quiero\s+(saber\s+)?(el\s+)?precio\s+de\s+(la|el|los|las)?\s*',
+    r'consulta\s+(el\s+)?precio\s+de\s+(la|el|los|las)?\s*',
+    r'busca(r)?\s+(el\s+)?precio\s+de\s+(la|el|los|las)?\s*',
+    r'precio\s+de\s+(la|el|los|las)?\s*',
+    r'tr[aá]eme\s+(el|la|los|las)?\s*',
+    r'cu[aá]l\s+es\s+(el|la)?\s*',
+    r'dame\s+(el|la|los|las)?\s*',
+    r'busca(r)?\s*',
+    r'precio\s+de(l)?\s*',
+    r'\bprecio\b',
+    r'\bcuanto\s+cuesta\b',
+    r'\bcuánto\s+cuesta\b',
+)), re.IGNORECASE)
+# Pure greetings and help requests (no product/store context), matched in one scan
+_GREETINGS = (
+    'hola', 'hello', 'hi', 'hey', 'buenos días', 'buenas tardes', 'buenas noches',
+    'ayuda', 'help', 'qué puedes', 'que puedes', 'para qué sirves',
+    'para que sirves', 'qué haces', 'que haces', 'cómo funciona', 'como funciona'
+)
+_GREETING_RE = re.compile('|'.join(map(re.escape, _GREETINGS)))
+
+_WS_RE = re.compile(r'\s+')
+_LEADING_ARTICLE_RE = re.compile(r'^(el|la|los|las|de|del)\s+', re.IGNORECASE)
+
+# Header of the text-search results table (#, producto, precio, similitud)
+_SEARCH_TABLE_HEADER = f"{'#':<4} {'PRODUCTO':<45} {'PRECIO':>10} {'SIMILITUD':>10}"
+
+# Message subtypes we handle (plain messages and file uploads)
+_ALLOWED_SUBTYPES = frozenset({None, "", "file_share"})
+
+# Image uploads as Slack reports them most often
+_IMAGE_MIMETYPES = frozenset({"image/jpeg", "image/png", "image/gif", "image/webp", "image/heic"})
+
+# Static replies (built once at import)
+_HELP_MESSAGE = (
+    "¡Hola! 👋 Soy *Patricia*, tu asistente de análisis de precios. ¿Qué puedo hacer por ti?\n\n"
+    "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+    "🔍 *BÚSQUEDA EN BASE DE DATOS*\n"
+    "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+    "Puedo buscar productos en nuestra base de datos interna para verificar que los precios en tienda sean los correctos.\n\n"
+    "*Ejemplo:*\n"
+    "• _\"¿Cuánto cuesta la Harina en la tienda 100?\"_\n"
+    "• _\"Busca el precio del Queso Panela en tienda 205\"_\n\n"
+    "⚠️ *Importante:* Siempre indica el número de tienda, ya que cada una tiene sus propios precios.\n\n"
+    "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+    "📸 *ANÁLISIS POR IMAGEN*\n"
+    "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+    "También puedo analizar precios desde fotos de los estantes de tu tienda.\n\n"
+    "*Ejemplo:*\n"
+    "• _\"Por favor analiza los productos de esta imagen de la tienda 100\"_\n"
+    "• _\"Revisa los precios de esta foto de la tienda 305\"_\n\n"
+    "*Mi análisis incluye:*\n"
+    "• Identificación de productos y precios\n"
+    "• Comparación con base de datos\n"
+    "• Estado del producto (correcto/incorrecto)\n"
+    "• Diferencia de precios si aplica\n"
+    "• Tienda de referencia\n\n"
+    "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+    "¿En qué puedo ayudarte hoy? 😊"
+)
+
+_MISSING_TIENDA_MESSAGE = (
+    "⚠️ *Por favor incluye el número de tienda en tu mensaje.*\n\n"
+    "Ejemplos:\n"
+    "• `Tienda 810`\n"
+    "• `tienda: 810`\n"
+    "• `#810`\n"
+    "• O simplemente el número `810` junto con la imagen"
+)
+
+_NO_PRODUCTS_MESSAGE = (
+    "⚠️ No se pudieron identificar productos en la imagen.\n"
+    "Asegúrate de que la imagen muestre claramente los productos y precios."
+)
+
 
 class SlackHandler:
     """
     Handles Slack events and messages.
     Implements the same flow as the n8n AgentePatricia workflow:
     1. Receive message with image
-    2. Add "eyes" reaction
+    2. Post a status message
     3. Process image and validate prices
-    4. Remove "eyes", add "white_check_mark"
+    4. Mark the status message as complete
     5. Send results
     """
     
@@ -38,40 +138,38 @@ class SlackHandler:
         self.slack_app = slack_app
         self.vision = vision_service
         self.validator = price_validator
-        self.processing_messages: Set[str] = set()  # Prevent duplicate processing
+        # Prevent duplicate processing: last N message timestamps seen (oldest evicted first)
+        self._dedupe: "OrderedDict[str, None]" = OrderedDict()
+        self._dedupe_cap = 4096
+        # Allowed Slack users (empty = everyone); settings are immutable, so build it once
+        self._allowed_users = frozenset(settings.get_allowed_users())
         
         logger.info("✅ SlackHandler initialized")
     
     def register_handlers(self):
         """Register all Slack event handlers"""
         
-        @self.slack_app.event("message")
-        async def handle_message(event, say, client: AsyncWebClient):
-            """Handle direct messages and channel messages"""
-            # Ignore ALL bot messages (including our own)
-            if event.get("bot_id"):
-                return
-            
-            # Ignore messages from bots (alternative check)
-            if event.get("bot_profile"):
-                return
-            
-            # Ignore message_changed, message_deleted, and other subtypes except file_share
-            subtype = event.get("subtype")
-            if subtype and subtype not in ["file_share"]:
-                return
-            
-            # Final safety check - ignore if no user
-            if not event.get("user"):
-                return
-            
-            await self._process_message(event, say, client)
+        self.slack_app.event("message")(self._handle_message_entry)
         
         # Note: app_mention events are already captured by the message event handler
         # so we don't need a separate handler for mentions
         
         logger.info("✅ Slack event handlers registered")
     
+    async def _handle_message_entry(self, event, say, client: AsyncWebClient):
+        """Handle direct messages and channel messages"""
+        # Ignore bot messages (including our own), edits/deletes and other
+        # subtypes except file_share, and anything without a user
+        if (
+            event.get("bot_id")
+            or event.get("bot_profile")
+            or event.get("subtype") not in _ALLOWED_SUBTYPES
+            or not event.get("user")
+        ):
+            return
+        
+        await self._process_message(event, say, client)
+    
     async def _process_message(
         self, 
         event: dict, 
@@ -87,17 +185,18 @@ class SlackHandler:
         user = event.get("user")
         
         # Prevent duplicate processing (Slack can send same event multiple times)
-        if message_ts in self.processing_messages:
+        if message_ts in self._dedupe:
             logger.debug(f"Skipping duplicate message: {message_ts}")
             return
         
         # Check if user is allowed (if restriction is configured)
-        allowed_users = settings.get_allowed_users()
-        if allowed_users and user not in allowed_users:
+        if self._allowed_users and user not in self._allowed_users:
             logger.info(f"User {user} not in allowed list, ignoring")
             return
         
-        self.processing_messages.add(message_ts)
+        self._dedupe[message_ts] = None
+        while len(self._dedupe) > self._dedupe_cap:
+            self._dedupe.popitem(last=False)
         
         try:
             text = event.get("text", "")
@@ -105,9 +204,10 @@ class SlackHandler:
             subtype = event.get("subtype", "")
             
             # Log event details for debugging
-            logger.info(f"📨 Message received - User: {user}, Channel: {channel}")
-            logger.info(f"   Text: {text[:100] if text else 'None'}...")
-            logger.info(f"   Subtype: {subtype}, Files count: {len(files)}")
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(f"📨 Message received - User: {user}, Channel: {channel}")
+                logger.info(f"   Text: {text[:100] if text else 'None'}...")
+                logger.info(f"   Subtype: {subtype}, Files count: {len(files)}")
             
             # Check if there's an image file
             image_file = self._find_image_file(files)
@@ -141,22 +241,18 @@ class SlackHandler:
                 await say(f"❌ Error procesando tu solicitud: {str(e)[:200]}")
             except:
                 pass
-        finally:
-            # Remove from processing set after a delay
-            asyncio.create_task(self._cleanup_message(message_ts))
-    
-    async def _cleanup_message(self, message_ts: str):
-        """Remove message from processing set after delay"""
-        await asyncio.sleep(60)  # Keep in set for 60 seconds
-        self.processing_messages.discard(message_ts)
     
     def _find_image_file(self, files: list) -> Optional[dict]:
         """Find first image file in list of files"""
-        for f in files:
-            mimetype = f.get("mimetype", "")
-            if mimetype.startswith("image/"):
-                return f
-        return None
+        # Common Slack image types hit the set; anything else falls back to the prefix check
+        return next(
+            (
+                f for f in files
+                if (mimetype := f.get("mimetype")) in _IMAGE_MIMETYPES
+                or (mimetype or "").startswith("image/")
+            ),
+            None
+        )
     
     async def _handle_image_analysis(
         self,
@@ -170,38 +266,30 @@ class SlackHandler:
     ):
         """
         Handle shelf image analysis request.
-        Follows the exact flow:
-        1. Add "eyes" reaction
+        Progress is shown in a single status message that is edited in place
+        (one post + edits instead of a reaction per step):
+        1. Post "analizando" status
         2. Download and analyze image
         3. Search products in Qdrant (semantic search)
         4. Generate comparison report
-        5. Remove "eyes", add "white_check_mark"
+        5. Mark the status as complete
         6. Send results
         """
-        message_ts = event.get("ts")
-        
         # Extract store ID from message text
         tienda_id = self._extract_tienda_id(text)
         
         if not tienda_id:
-            output = (
-                "⚠️ *Por favor incluye el número de tienda en tu mensaje.*\n\n"
-                "Ejemplos:\n"
-                "• `Tienda 810`\n"
-                "• `tienda: 810`\n"
-                "• `#810`\n"
-                "• O simplemente el número `810` junto con la imagen"
-            )
-            await say(output)
+            await say(_MISSING_TIENDA_MESSAGE)
             return
         
-        # Step 1: Add "eyes" reaction to show we're processing
-        await self._add_reaction(client, channel, message_ts, "eyes")
+        # Step 1: Post the status message while the image downloads
+        ack = asyncio.ensure_future(
+            say(f"🔍 Analizando imagen para *Tienda {tienda_id}*... Por favor espera.")
+        )
+        progress = None
+        done = None
         
         try:
-            # Send initial acknowledgment
-            await say(f"🔍 Analizando imagen para *Tienda {tienda_id}*... Por favor espera.")
-            
             # Step 2: Download image from Slack
             image_url = image_file.get("url_private")
             if not image_url:
@@ -215,31 +303,34 @@ class SlackHandler:
             
             # Step 3: Analyze image with Gemini Vision
             logger.info(f"🔬 Analyzing image with Gemini...")
-            productos, tokens_used = await self.vision.analyze_shelf_image_with_tokens(image_bytes)
+            productos, tokens_used = await self.vision.analyze_shelf_image_with_tokens(
+                image_bytes, content_type=image_file.get("mimetype")
+            )
+            
+            # Status message must exist before it can be edited
+            status = await ack
             
             if not productos:
-                await self._remove_reaction(client, channel, message_ts, "eyes")
-                await self._add_reaction(client, channel, message_ts, "warning")
-                await say(
-                    "⚠️ No se pudieron identificar productos en la imagen.\n"
-                    "Asegúrate de que la imagen muestre claramente los productos y precios."
-                )
+                await self._update_status(client, status, _NO_PRODUCTS_MESSAGE)
                 return
             
-            # Send progress update
-            await say(f"📦 Se identificaron *{len(productos)}* productos. Validando precios...")
+            # Update the status while validation runs
+            progress = asyncio.ensure_future(self._update_status(
+                client, status, f"📦 Se identificaron *{len(productos)}* productos. Validando precios..."
+            ))
             
             # Step 4: Validate prices against Qdrant database
             logger.info(f"💰 Validating prices for {len(productos)} products...")
             validaciones = await self.validator.validate_products(productos, tienda_id)
             
-            # Step 5: Remove "eyes" and add "white_check_mark"
-            await self._remove_reaction(client, channel, message_ts, "eyes")
-            await self._add_reaction(client, channel, message_ts, "white_check_mark")
-            
-            # Step 6: Format and send results
+            # Step 5: Format results and mark the status as complete
             resultado = self.validator.format_results_for_slack(validaciones, tienda_id)
+            await progress
+            done = asyncio.ensure_future(self._update_status(
+                client, status, f"✅ Análisis completo para *Tienda {tienda_id}*."
+            ))
             
+            # Step 6: Send results
             # Split message if too long (Slack limit is ~4000 chars)
             if len(resultado) > 3900:
                 parts = self._split_message(resultado)
@@ -247,14 +338,23 @@ class SlackHandler:
                     await say(part)
             else:
                 await say(resultado)
+            await done
             
             logger.info(f"✅ Image analysis complete for store {tienda_id}")
             
         except Exception as e:
             logger.error(f"❌ Image analysis failed: {e}", exc_info=True)
-            await self._remove_reaction(client, channel, message_ts, "eyes")
-            await self._add_reaction(client, channel, message_ts, "x")
-            await say(f"❌ Error al analizar la imagen: {str(e)[:200]}")
+            error_text = f"❌ Error al analizar la imagen: {str(e)[:200]}"
+            # Let pending Slack posts finish so the messages stay in order
+            if progress is not None:
+                await asyncio.gather(progress, return_exceptions=True)
+            if done is not None:
+                await asyncio.gather(done, return_exceptions=True)
+            status = (await asyncio.gather(ack, return_exceptions=True))[0]
+            if isinstance(status, BaseException):
+                await say(error_text)
+            else:
+                await self._update_status(client, status, error_text)
     
     async def _handle_text_query(
         self,
@@ -279,8 +379,7 @@ class SlackHandler:
         if self._is_greeting_or_help(text):
             await self._add_reaction(client, channel, message_ts, "eyes")
             await say(self._get_help_message())
-            await self._remove_reaction(client, channel, message_ts, "eyes")
-            await self._add_reaction(client, channel, message_ts, "white_check_mark")
+            await self._swap_reaction(client, channel, message_ts, "eyes", "white_check_mark")
             return
         
         # Extract store ID
@@ -299,8 +398,7 @@ class SlackHandler:
                 "⚠️ Para buscar un producto necesito el número de tienda.\n"
                 f"Ejemplo: `Tráeme el precio de {search_term} de la tienda 810`"
             )
-            await self._remove_reaction(client, channel, message_ts, "eyes")
-            await self._add_reaction(client, channel, message_ts, "x")
+            await self._swap_reaction(client, channel, message_ts, "eyes", "x")
             return
         
         # Add eyes reaction to show we're processing
@@ -315,24 +413,20 @@ class SlackHandler:
                 score_threshold=0.5
             )
             
-            # Remove eyes reaction
-            await self._remove_reaction(client, channel, message_ts, "eyes")
-            
             if matches:
                 # Format results
                 resultado = self._format_search_results(matches, search_term, tienda_id)
                 await say(resultado)
-                await self._add_reaction(client, channel, message_ts, "white_check_mark")
+                await self._swap_reaction(client, channel, message_ts, "eyes", "white_check_mark")
             else:
                 await say(
                     f"⚠️ No encontré *\"{search_term}\"* en la tienda {tienda_id}.\n"
                     "Intenta con otro nombre o verifica el número de tienda."
                 )
-                await self._add_reaction(client, channel, message_ts, "x")
+                await self._swap_reaction(client, channel, message_ts, "eyes", "x")
                 
         except Exception as e:
-            await self._remove_reaction(client, channel, message_ts, "eyes")
-            await self._add_reaction(client, channel, message_ts, "x")
+            await self._swap_reaction(client, channel, message_ts, "eyes", "x")
             logger.error(f"Search failed: {e}")
             await say(f"❌ Error en la búsqueda: {str(e)[:100]}")
     
@@ -349,23 +443,28 @@ class SlackHandler:
         if not matches:
             return f"⚠️ No encontré *\"{search_term}\"* en la tienda {tienda_id}."
         
+        # Rows padded with str.ljust/rjust (same columns as _SEARCH_TABLE_HEADER)
+        rows = [
+            " ".join((
+                str(i).ljust(4),
+                match.nombre[:44].ljust(45),
+                f"${match.precio:.2f}".rjust(10),
+                f"{match.score:.0%}".rjust(10)
+            ))
+            for i, match in enumerate(matches, 1)
+        ]
+        
         lines = [
             f"🔍 Resultados para *\"{search_term}\"* en tienda *{tienda_id}*:",
             "",
             "```",
-            f"{'#':<4} {'PRODUCTO':<45} {'PRECIO':>10} {'SIMILITUD':>10}",
-            "-" * 75
+            _SEARCH_TABLE_HEADER,
+            "-" * 75,
+            *rows,
+            "```",
+            f"\n_Se encontraron {len(matches)} productos similares._"
         ]
         
-        for i, match in enumerate(matches, 1):
-            nombre = match.nombre[:44] if len(match.nombre) > 44 else match.nombre
-            precio = f"${match.precio:.2f}"
-            score = f"{match.score:.0%}"
-            lines.append(f"{i:<4} {nombre:<45} {precio:>10} {score:>10}")
-        
-        lines.append("```")
-        lines.append(f"\n_Se encontraron {len(matches)} productos similares._")
-        
         return "\n".join(lines)
     
     def _extract_tienda_id(self, text: str) -> Optional[int]:
@@ -373,22 +472,16 @@ class SlackHandler:
         Extract store ID from message text.
         Supports multiple formats.
         """
-        if not text:
+        # Fast path: most messages without digits can't name a store
+        if not text or not _DIGIT_RE.search(text):
             return None
         
         text_lower = text.lower()
         
-        # Patrones en orden de especificidad
-        patterns = [
-            r'tienda\s*[#:]?\s*(\d+)',      # "tienda 810", "tienda: 810", "tienda #810"
-            r'store\s*[#:]?\s*(\d+)',        # "store 810"
-            r'sucursal\s*[#:]?\s*(\d+)',     # "sucursal 810"
-            r'#(\d{3,4})\b',                 # "#810"
-            r'\b(\d{3,4})\b'                 # Standalone 3-4 digit number as fallback
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, text_lower)
+        # Patterns are tried in priority order (a "tienda N" anywhere beats an
+        # earlier "#N"), so they are not fused into one leftmost-match alternation
+        for pattern in _TIENDA_PATTERNS:
+            match = pattern.search(text_lower)
             if match:
                 tienda_id = int(match.group(1))
                 # Validar rango razonable (ajustar según tu negocio)
@@ -405,41 +498,16 @@ class SlackHandler:
         cleaned = text
         
         # Remover menciones del bot primero
-        cleaned = re.sub(r'<@[A-Z0-9]+>', '', cleaned)
-        
-        # Remover referencias a tienda
-        cleaned = re.sub(r'(de\s+la\s+)?tienda\s*[#:]?\s*\d+', '', cleaned, flags=re.IGNORECASE)
-        cleaned = re.sub(r'(de\s+la\s+)?store\s*[#:]?\s*\d+', '', cleaned, flags=re.IGNORECASE)
-        cleaned = re.sub(r'(de\s+la\s+)?sucursal\s*[#:]?\s*\d+', '', cleaned, flags=re.IGNORECASE)
-        cleaned = re.sub(r'#\d+', '', cleaned)
-        
-        # Remover frases comunes de solicitud (en orden de más específico a menos)
-        frases_remover = [
-            r'tr[aá]eme\s+el\s+precio\s+de\s+(la|el|los|las)?\s*',
-            r'cu[aá]l\s+es\s+el\s+precio\s+de\s+(la|el|los|las)?\s*',
-            r'dame\s+el\s+precio\s+de\s+(la|el|los|las)?\s*',
-            r'quiero\s+(saber\s+)?(el\s+)?precio\s+de\s+(la|el|los|las)?\s*',
-            r'consulta\s+(el\s+)?precio\s+de\s+(la|el|los|las)?\s*',
-            r'busca(r)?\s+(el\s+)?precio\s+de\s+(la|el|los|las)?\s*',
-            r'precio\s+de\s+(la|el|los|las)?\s*',
-            r'tr[aá]eme\s+(el|la|los|las)?\s*',
-            r'cu[aá]l\s+es\s+(el|la)?\s*',
-            r'dame\s+(el|la|los|las)?\s*',
-            r'busca(r)?\s*',
-            r'precio\s+de(l)?\s*',
-            r'\bprecio\b',
-            r'\bcuanto\s+cuesta\b',
-            r'\bcuánto\s+cuesta\b',
-        ]
+        cleaned = _MENTION_RE.sub('', cleaned)
         
-        for patron in frases_remover:
-            cleaned = re.sub(patron, '', cleaned, flags=re.IGNORECASE)
+        # Remover referencias a tienda y frases comunes de solicitud (una sola pasada)
+        cleaned = _CLEANUP_RE.sub('', cleaned)
         
         # Limpiar espacios múltiples y extremos
-        cleaned = re.sub(r'\s+', ' ', cleaned).strip()
+        cleaned = _WS_RE.sub(' ', cleaned).strip()
         
         # Remover artículos sueltos al inicio
-        cleaned = re.sub(r'^(el|la|los|las|de|del)\s+', '', cleaned, flags=re.IGNORECASE)
+        cleaned = _LEADING_ARTICLE_RE.sub('', cleaned)
         
         cleaned = cleaned.strip()
         
@@ -450,74 +518,45 @@ class SlackHandler:
         Check if message is a greeting or help request.
         Returns False if the message contains a store ID (indicating a product query).
         """
-        text_lower = text.lower()
-        
-        # If message contains a store ID, it's likely a product query, not a greeting
-        if self._extract_tienda_id(text):
-            return False
-        
-        # Pure greetings and help requests (no product/store context)
-        greetings = [
-            'hola', 'hello', 'hi', 'hey', 'buenos días', 'buenas tardes', 'buenas noches',
-            'ayuda', 'help', 'qué puedes', 'que puedes', 'para qué sirves', 
-            'para que sirves', 'qué haces', 'que haces', 'cómo funciona', 'como funciona'
-        ]
-        
-        # Only match if it's a short message or contains greeting words without product context
-        is_greeting = any(g in text_lower for g in greetings)
-        
         # If it's just "?" alone, it's help
         if text.strip() == '?':
             return True
         
-        return is_greeting
+        # Only match if it contains greeting words without product context
+        if not _GREETING_RE.search(text.lower()):
+            return False
+        
+        # If message contains a store ID, it's likely a product query, not a greeting
+        return not self._extract_tienda_id(text)
     
     def _get_help_message(self) -> str:
         """Return the help/greeting message"""
-        return (
-            "¡Hola! 👋 Soy *Patricia*, tu asistente de análisis de precios. ¿Qué puedo hacer por ti?\n\n"
-            "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
-            "🔍 *BÚSQUEDA EN BASE DE DATOS*\n"
-            "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
-            "Puedo buscar productos en nuestra base de datos interna para verificar que los precios en tienda sean los correctos.\n\n"
-            "*Ejemplo:*\n"
-            "• _\"¿Cuánto cuesta la Harina en la tienda 100?\"_\n"
-            "• _\"Busca el precio del Queso Panela en tienda 205\"_\n\n"
-            "⚠️ *Importante:* Siempre indica el número de tienda, ya que cada una tiene sus propios precios.\n\n"
-            "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
-            "📸 *ANÁLISIS POR IMAGEN*\n"
-            "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
-            "También puedo analizar precios desde fotos de los estantes de tu tienda.\n\n"
-            "*Ejemplo:*\n"
-            "• _\"Por favor analiza los productos de esta imagen de la tienda 100\"_\n"
-            "• _\"Revisa los precios de esta foto de la tienda 305\"_\n\n"
-            "*Mi análisis incluye:*\n"
-            "• Identificación de productos y precios\n"
-            "• Comparación con base de datos\n"
-            "• Estado del producto (correcto/incorrecto)\n"
-            "• Diferencia de precios si aplica\n"
-            "• Tienda de referencia\n\n"
-            "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
-            "¿En qué puedo ayudarte hoy? 😊"
-        )
+        return _HELP_MESSAGE
     
     def _split_message(self, message: str, max_length: int = 3900) -> list:
         """Split long message into chunks for Slack"""
         if len(message) <= max_length:
             return [message]
         
+        # Accumulate lines per part and join once per flush (no quadratic concatenation)
         parts = []
-        current = ""
+        buf = []
+        buf_len = 0  # len('\n'.join(buf))
         
         for line in message.split('\n'):
-            if len(current) + len(line) + 1 > max_length:
-                parts.append(current)
-                current = line
+            if buf_len + len(line) + 1 > max_length:
+                parts.append('\n'.join(buf))
+                buf = [line]
+                buf_len = len(line)
+            elif buf_len:
+                buf.append(line)
+                buf_len += len(line) + 1
             else:
-                current = current + '\n' + line if current else line
+                buf = [line]
+                buf_len = len(line)
         
-        if current:
-            parts.append(current)
+        if buf_len:
+            parts.append('\n'.join(buf))
         
         return parts
     
@@ -538,6 +577,27 @@ class SlackHandler:
         except Exception as e:
             logger.debug(f"Could not add reaction {reaction}: {e}")
     
+    async def _swap_reaction(
+        self,
+        client: AsyncWebClient,
+        channel: str,
+        timestamp: str,
+        old: str,
+        new: str
+    ):
+        """Replace one reaction with another (both calls sent concurrently)"""
+        # Both helpers swallow their own errors, so the group never raises
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(self._remove_reaction(client, channel, timestamp, old))
+            tg.create_task(self._add_reaction(client, channel, timestamp, new))
+    
+    async def _update_status(self, client: AsyncWebClient, status, text: str):
+        """Edit a previously posted status message in place (silently fail)"""
+        try:
+            await client.chat_update(channel=status["channel"], ts=status["ts"], text=text)
+        except Exception as e:
+            logger.debug(f"Could not update status message: {e}")
+    
     async def _remove_reaction(
         self, 
         client: AsyncWebClient, 
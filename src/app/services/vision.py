@@ -3,12 +3,18 @@ Vision service using Gemini for shelf image analysis.
 Extracts product names and prices from store shelf photos.
 """
 import asyncio
+import hashlib
+import io
 import logging
-import json
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional, Tuple
 
 import httpx
+import orjson
+from PIL import Image, ImageOps
+from cachetools import TTLCache
 import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 
@@ -16,6 +22,84 @@ from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Limpieza y extracción de la respuesta de Gemini (compiladas una sola vez)
+_MD_JSON_PREFIX_RE = re.compile(r'^```json\s*')
+_MD_FENCE_SUFFIX_RE = re.compile(r'\s*```$')
+# Keys of a product object, for when JSON parsing fails completely
+# (anchored patterns: no backtracking across the response)
+_NOMBRE_KEY_RE = re.compile(r'"nombre"\s*:\s*"', re.IGNORECASE)
+_PRECIO_VALUE_RE = re.compile(r'"precio"\s*:\s*(\d+(?:\.\d+)?)', re.IGNORECASE)
+_NON_NUMERIC_RE = re.compile(r'[^\d.]')
+
+# Magic numbers: (offset, signature, MIME type), checked in order
+_MIME_SIGNATURES = (
+    (0, b'\x89PNG\r\n\x1a\n', "image/png"),
+    (0, b'\xff\xd8', "image/jpeg"),
+    (0, b'GIF87a', "image/gif"),
+    (0, b'GIF89a', "image/gif"),
+    (8, b'WEBP', "image/webp"),
+)
+
+# Declared content types used as-is, without sniffing the bytes
+_KNOWN_MIME_TYPES = frozenset(mime_type for _, _, mime_type in _MIME_SIGNATURES)
+
+# Placeholder prices Gemini uses when the tag can't be read
+_PRICE_NULL_STRINGS = frozenset({"No visible", "null", "NULL", "None", ""})
+
+# Placeholder names Gemini uses for unreadable products
+_INVALID_NAMES = frozenset({"", "NULL", "NONE", "NO VISIBLE", "NO LEGIBLE"})
+
+
+def _bracket_balance(text: str) -> Tuple[int, int]:
+    """Unclosed '[' and '{' in text (negative when there are extra closers)"""
+    return text.count('[') - text.count(']'), text.count('{') - text.count('}')
+
+
+def _scan_products(text: str) -> List[Tuple[str, str]]:
+    """
+    Find (nombre, precio) pairs in malformed JSON.
+    
+    For every "nombre" key, the quoted name is read with str.find and the
+    first "precio" before the object's closing '}' is taken as its price.
+    Objects without a name or a numeric price are skipped. The next '}' and
+    "precio" positions are reused while still ahead, so the scan stays
+    linear even when many keys share one unterminated object.
+    """
+    pairs = []
+    pos = 0
+    object_end = -1
+    precio = None
+    while (key := _NOMBRE_KEY_RE.search(text, pos)) is not None:
+        name_start = key.end()
+        name_end = text.find('"', name_start)
+        if name_end == -1:
+            break
+        
+        if object_end <= name_end:
+            object_end = text.find('}', name_end + 1)
+            if object_end == -1:
+                object_end = len(text)
+        if precio is not None and precio.start() <= name_end:
+            precio = None
+        if precio is None:
+            precio = _PRECIO_VALUE_RE.search(text, name_end + 1)
+            if precio is None:
+                break  # No prices left anywhere after this point
+        
+        if name_end == name_start or precio.start() >= object_end:
+            pos = key.start() + 1
+            continue
+        
+        pairs.append((text[name_start:name_end], precio.group(1)))
+        pos = precio.end()
+    
+    return pairs
+
+
+def _image_digest(image_bytes: bytes) -> str:
+    """SHA-256 of the raw image, used as the result cache key"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
 
 class VisionService:
     """
@@ -57,7 +141,7 @@ Retorna ÚNICAMENTE un JSON válido con la siguiente estructura (sin markdown, s
 ]
 
 Solo retorna el JSON puro, nada más."""
-
+    
     def __init__(self):
         """Initialize Gemini client"""
         self._configure_gemini()
@@ -71,8 +155,40 @@ Solo retorna el JSON puro, nada más."""
             HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
         }
         
+        # Dedicated threads for the blocking Gemini SDK, so uploads never queue
+        # behind other work on the loop's default executor
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.GEMINI_CONCURRENCY,
+            thread_name_prefix="gemini"
+        )
+        
+        # Recent results by image digest (None when disabled)
+        self._result_cache: Optional[TTLCache] = None
+        if settings.VISION_CACHE_SIZE > 0:
+            self._result_cache = TTLCache(
+                maxsize=settings.VISION_CACHE_SIZE,
+                ttl=settings.VISION_CACHE_TTL
+            )
+        
+        # Shared HTTP client for Slack file downloads (keeps TLS connections alive)
+        self._http = httpx.AsyncClient(
+            follow_redirects=True,
+            timeout=60.0,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+        )
+        
         logger.info(f"✅ VisionService initialized with model: {settings.GEMINI_MODEL}")
     
+    @classmethod
+    async def create(cls) -> "VisionService":
+        """Build the service in a worker thread so startup can overlap with other services"""
+        return await asyncio.to_thread(cls)
+    
+    async def close(self):
+        """Close the pooled HTTP client and the Gemini worker threads"""
+        await self._http.aclose()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+    
     def _configure_gemini(self):
         """Configure Gemini API credentials"""
         if settings.GEMINI_API_KEY:
@@ -92,123 +208,223 @@ Solo retorna el JSON puro, nada más."""
         Download image from Slack private URL.
         Slack requires authentication to access private file URLs.
         """
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                url,
-                headers={"Authorization": f"Bearer {bot_token}"},
-                follow_redirects=True,
-                timeout=60.0
-            )
-            response.raise_for_status()
-            logger.info(f"✅ Downloaded image: {len(response.content)} bytes")
-            return response.content
+        response = await self._http.get(
+            url,
+            headers={"Authorization": f"Bearer {bot_token}"}
+        )
+        response.raise_for_status()
+        logger.info(f"✅ Downloaded image: {len(response.content)} bytes")
+        return response.content
     
-    async def analyze_shelf_image(self, image_bytes: bytes) -> List[Dict[str, Any]]:
+    async def analyze_shelf_image(
+        self,
+        image_bytes: bytes,
+        use_cache: bool = True,
+        content_type: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
         """
         Analyze shelf image and extract products with prices.
         
+        Args:
+            image_bytes: Raw image
+            use_cache: Reuse the result of an identical image analyzed recently
+            content_type: Declared MIME type, if known (skips byte sniffing)
+        
         Returns:
             List of products with: nombre, precio, presentacion, categoria
         """
-        try:
-            # Detectar tipo de imagen
-            mime_type = self._detect_mime_type(image_bytes)
-            
-            # Crear parte de imagen para Gemini
-            image_part = {
-                "mime_type": mime_type,
-                "data": image_bytes
-            }
-            
-            # Generar contenido con Gemini
-            logger.info("🔍 Analyzing image with Gemini...")
-            response = await asyncio.to_thread(
-                self.model.generate_content,
-                [self.EXTRACTION_PROMPT, image_part],
-                safety_settings=self.safety_settings,
-                generation_config={
-                    "temperature": 0.1,
-                    "max_output_tokens": 8192,
-                }
-            )
-            
-            # Parsear respuesta
-            text = response.text.strip()
-            products = self._parse_gemini_response(text)
-            
-            # Deduplicar productos
-            products = self._deduplicate_products(products)
-            
-            logger.info(f"✅ Extracted {len(products)} unique products from image")
-            return products
-            
-        except Exception as e:
-            logger.error(f"❌ Vision analysis failed: {e}", exc_info=True)
-            raise
+        products, _ = await self.analyze_shelf_image_with_tokens(
+            image_bytes, use_cache=use_cache, content_type=content_type
+        )
+        return products
     
-    async def analyze_shelf_image_with_tokens(self, image_bytes: bytes) -> Tuple[List[Dict[str, Any]], int]:
+    async def analyze_shelf_image_with_tokens(
+        self,
+        image_bytes: bytes,
+        use_cache: bool = True,
+        content_type: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], int]:
         """
         Analyze shelf image and extract products with prices.
         Also returns token usage for metrics.
         
+        Args:
+            image_bytes: Raw image
+            use_cache: Reuse the result of an identical image analyzed recently
+            content_type: Declared MIME type, if known. PNG/JPEG/GIF/WEBP are
+                trusted as-is; anything else is detected from the bytes
+        
         Returns:
-            Tuple of (products list, tokens used)
+            Tuple of (products list, tokens used); tokens is 0 on a cache hit
         """
         try:
-            # Detectar tipo de imagen
-            mime_type = self._detect_mime_type(image_bytes)
-            
-            # Crear parte de imagen para Gemini
-            image_part = {
-                "mime_type": mime_type,
-                "data": image_bytes
-            }
+            # Misma imagen (mismo SHA-256) -> mismo resultado, sin llamar a Gemini
+            cache_key = None
+            if use_cache and self._result_cache is not None:
+                cache_key = await asyncio.to_thread(_image_digest, image_bytes)
+                cached = self._result_cache.get(cache_key)
+                if cached is not None:
+                    logger.info(f"♻️ Image already analyzed, reusing {len(cached)} products")
+                    return list(cached), 0
             
-            # Generar contenido con Gemini
+            # Reducción + Gemini + parsing en un hilo de trabajo (nada bloqueante en el event loop)
             logger.info("🔍 Analyzing image with Gemini...")
-            response = await asyncio.to_thread(
-                self.model.generate_content,
-                [self.EXTRACTION_PROMPT, image_part],
-                safety_settings=self.safety_settings,
-                generation_config={
-                    "temperature": 0.1,
-                    "max_output_tokens": 8192,
-                }
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            products, tokens_used = await loop.run_in_executor(
+                self._executor, self._generate_and_parse, image_bytes, content_type
             )
+            logger.info(f"⏱️ Vision analysis took {loop.time() - started:.2f}s")
             
-            # Extract token usage
-            tokens_used = 0
-            if hasattr(response, 'usage_metadata'):
-                usage = response.usage_metadata
-                tokens_used = getattr(usage, 'total_token_count', 0) or 0
-                logger.info(f"📊 Tokens used: {tokens_used}")
-            
-            # Parsear respuesta
-            text = response.text.strip()
-            products = self._parse_gemini_response(text)
-            
-            # Deduplicar productos
-            products = self._deduplicate_products(products)
+            # Empty results are not cached so a retry gets a fresh attempt
+            if cache_key is not None and products:
+                self._result_cache[cache_key] = tuple(products)
             
             logger.info(f"✅ Extracted {len(products)} unique products from image")
             return products, tokens_used
-            
+        
         except Exception as e:
             logger.error(f"❌ Vision analysis failed: {e}", exc_info=True)
             raise
     
+    async def analyze_shelf_images(
+        self,
+        images: List[bytes],
+        concurrency: int = settings.GEMINI_CONCURRENCY,
+        use_cache: bool = True
+    ) -> List[Tuple[List[Dict[str, Any]], int]]:
+        """
+        Analyze several shelf images concurrently.
+        
+        Identical images in the batch are sent to Gemini once; their
+        duplicates get a copy of the products and 0 tokens.
+        
+        Args:
+            images: Raw images
+            concurrency: Max Gemini calls in flight for this batch
+            use_cache: Reuse results of identical images analyzed recently
+        
+        Returns:
+            One (products list, tokens used) tuple per input image, in order
+        """
+        digests = await asyncio.to_thread(lambda: [_image_digest(b) for b in images])
+        
+        # First occurrence of each distinct image
+        first_index: Dict[str, int] = {}
+        for i, digest in enumerate(digests):
+            first_index.setdefault(digest, i)
+        
+        sem = asyncio.Semaphore(concurrency)
+        
+        async def analyze_one(i: int) -> Tuple[List[Dict[str, Any]], int]:
+            async with sem:
+                return await self.analyze_shelf_image_with_tokens(images[i], use_cache=use_cache)
+        
+        unique = list(first_index.values())
+        results = dict(zip(unique, await asyncio.gather(*(analyze_one(i) for i in unique))))
+        
+        if len(unique) != len(images):
+            logger.info(f"🔄 {len(images) - len(unique)} duplicate images in batch analyzed once")
+        
+        return [
+            results[i] if i in results else (list(results[first_index[digest]][0]), 0)
+            for i, digest in enumerate(digests)
+        ]
+    
+    def _prepare_image(self, image_bytes: bytes, content_type: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Build the Gemini image part, downscaling large photos first.
+        
+        Images whose long edge exceeds VISION_MAX_IMAGE_SIDE are resized to
+        fit it and re-encoded as JPEG (fewer bytes to upload, fewer image
+        tiles billed). Smaller images, or ones Pillow can't decode, are sent
+        as they are.
+        """
+        # Detectar tipo de imagen (el tipo declarado se usa si es uno conocido)
+        if content_type in _KNOWN_MIME_TYPES:
+            mime_type = content_type
+        else:
+            mime_type = self._detect_mime_type(image_bytes)
+        max_side = settings.VISION_MAX_IMAGE_SIDE
+        
+        if max_side > 0:
+            try:
+                # Image.open only reads the header, so the size check is cheap
+                img = Image.open(io.BytesIO(image_bytes))
+                if max(img.size) > max_side:
+                    original_size = img.size
+                    img = ImageOps.exif_transpose(img)  # Keep the photo upright without EXIF
+                    img.thumbnail((max_side, max_side), Image.LANCZOS)
+                    buf = io.BytesIO()
+                    img.convert("RGB").save(buf, format="JPEG", quality=85, optimize=True)
+                    logger.info(
+                        f"📐 Image downscaled {original_size} -> {img.size}, "
+                        f"{len(image_bytes)} -> {buf.tell()} bytes"
+                    )
+                    image_bytes = buf.getvalue()
+                    mime_type = "image/jpeg"
+            except Exception as e:
+                logger.warning(f"Could not downscale image, sending original: {e}")
+        
+        # Crear parte de imagen para Gemini
+        return {
+            "mime_type": mime_type,
+            "data": image_bytes
+        }
+    
+    def _generate_and_parse(
+        self,
+        image_bytes: bytes,
+        content_type: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Call Gemini and turn its response into deduplicated products.
+        Blocking (image resize + network + JSON parsing), so callers run it
+        in a worker thread.
+        
+        Returns:
+            Tuple of (products list, tokens used)
+        """
+        image_part = self._prepare_image(image_bytes, content_type)
+        
+        started = time.perf_counter()
+        response = self.model.generate_content(
+            [self.EXTRACTION_PROMPT, image_part],
+            safety_settings=self.safety_settings,
+            generation_config={
+                "temperature": 0.1,
+                "max_output_tokens": 8192,
+            }
+        )
+        gemini_time = time.perf_counter() - started
+        started += gemini_time
+        
+        # Extract token usage
+        tokens_used = 0
+        if hasattr(response, 'usage_metadata'):
+            usage = response.usage_metadata
+            tokens_used = getattr(usage, 'total_token_count', 0) or 0
+            logger.info(f"📊 Tokens used: {tokens_used}")
+        
+        # Parsear respuesta
+        text = response.text.strip()
+        products = self._parse_gemini_response(text)
+        
+        # Deduplicar productos
+        products = self._deduplicate_products(products)
+        
+        logger.debug(f"Gemini call {gemini_time:.2f}s, parsing {time.perf_counter() - started:.3f}s")
+        return products, tokens_used
+    
     def _detect_mime_type(self, image_bytes: bytes) -> str:
         """Detect image MIME type from bytes"""
-        if image_bytes[:8] == b'\x89PNG\r\n\x1a\n':
-            return "image/png"
-        elif image_bytes[:2] == b'\xff\xd8':
-            return "image/jpeg"
-        elif image_bytes[:6] in (b'GIF87a', b'GIF89a'):
-            return "image/gif"
-        elif image_bytes[:4] == b'RIFF' and image_bytes[8:12] == b'WEBP':
-            return "image/webp"
-        else:
-            return "image/jpeg"  # Default
+        head = image_bytes[:12]
+        for offset, signature, mime_type in _MIME_SIGNATURES:
+            if head.startswith(signature, offset):
+                # WEBP is a RIFF container: the RIFF tag must be there too
+                if mime_type != "image/webp" or head.startswith(b'RIFF'):
+                    return mime_type
+        return "image/jpeg"  # Default
     
     def _parse_gemini_response(self, text: str) -> List[Dict[str, Any]]:
         """
@@ -217,16 +433,16 @@ Solo retorna el JSON puro, nada más."""
         Robust against truncated/malformed JSON.
         """
         # Limpiar respuesta de markdown si viene
-        text = re.sub(r'^```json\s*', '', text)
-        text = re.sub(r'\s*```$', '', text)
+        text = _MD_JSON_PREFIX_RE.sub('', text)
+        text = _MD_FENCE_SUFFIX_RE.sub('', text)
         text = text.strip()
         
         data = None
         
         # Intento 1: Parse directo
         try:
-            data = json.loads(text)
-        except json.JSONDecodeError as e:
+            data = orjson.loads(text)
+        except orjson.JSONDecodeError as e:
             logger.warning(f"Direct JSON parse failed: {e}")
             
             # Intento 2: Reparar JSON truncado
@@ -246,32 +462,35 @@ Solo retorna el JSON puro, nada más."""
             data = [data]
         
         # Aplanar estructura de categorías -> productos
+        # (métodos ligados a locales: este bucle corre una vez por producto)
         productos_flat = []
+        append = productos_flat.append
+        parse_price = self._parse_price
         
         for seccion in data:
             if not isinstance(seccion, dict):
                 continue
-                
+            
             categoria = seccion.get("categoria", "General")
             productos = seccion.get("productos", [])
             
             if not productos and "nombre" in seccion:
                 # Es un producto directo, no una categoría
                 productos = [seccion]
-                categoria = seccion.get("categoria", "General")
             
             for producto in productos:
                 if not isinstance(producto, dict):
                     continue
-                    
-                nombre = str(producto.get("nombre", "")).upper().strip()
+                
+                get = producto.get
+                nombre = str(get("nombre", "")).upper().strip()
                 if nombre and nombre != "NULL":
-                    productos_flat.append({
+                    append({
                         "nombre": nombre,
-                        "precio": self._parse_price(producto.get("precio")),
-                        "presentacion": producto.get("presentacion", ""),
+                        "precio": parse_price(get("precio")),
+                        "presentacion": get("presentacion", ""),
                         "categoria": categoria,
-                        "observaciones": producto.get("observaciones")
+                        "observaciones": get("observaciones")
                     })
         
         return productos_flat
@@ -281,8 +500,7 @@ Solo retorna el JSON puro, nada más."""
         Attempt to repair truncated JSON by closing brackets/braces.
         """
         # Contar brackets abiertos
-        open_brackets = text.count('[') - text.count(']')
-        open_braces = text.count('{') - text.count('}')
+        open_brackets, open_braces = _bracket_balance(text)
         
         # Intentar cerrar
         repaired = text.rstrip().rstrip(',')  # Quitar trailing comma
@@ -290,23 +508,25 @@ Solo retorna el JSON puro, nada más."""
         repaired += ']' * open_brackets
         
         try:
-            data = json.loads(repaired)
+            data = orjson.loads(repaired)
             logger.info("✅ JSON repaired successfully")
             return data
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             # Intentar otra reparación más agresiva
             # Buscar el último objeto completo
             last_complete = text.rfind('},')
             if last_complete > 0:
                 truncated = text[:last_complete + 1]
-                # Cerrar arrays y objetos abiertos
-                open_brackets = truncated.count('[') - truncated.count(']')
-                open_braces = truncated.count('{') - truncated.count('}')
+                # Cerrar arrays y objetos abiertos (balance del prefijo =
+                # balance total menos el de la cola descartada, que es corta)
+                tail_brackets, tail_braces = _bracket_balance(text[last_complete + 1:])
+                open_brackets -= tail_brackets
+                open_braces -= tail_braces
                 truncated += '}' * max(0, open_braces)
                 truncated += ']' * max(0, open_brackets)
                 
                 try:
-                    data = json.loads(truncated)
+                    data = orjson.loads(truncated)
                     logger.info(f"✅ JSON repaired by truncation (kept until last complete object)")
                     return data
                 except:
@@ -316,15 +536,12 @@ Solo retorna el JSON puro, nada más."""
     
     def _extract_products_regex(self, text: str) -> List[Dict[str, Any]]:
         """
-        Extract products using regex when JSON parsing fails completely.
+        Extract products by scanning the text when JSON parsing fails completely.
         Looks for patterns like: "nombre": "...", "precio": ...
         """
         productos = []
         
-        # Pattern to match product objects
-        pattern = r'"nombre"\s*:\s*"([^"]+)"[^}]*?"precio"\s*:\s*(\d+(?:\.\d+)?)'
-        
-        matches = re.findall(pattern, text, re.IGNORECASE)
+        matches = _scan_products(text)
         
         for nombre, precio in matches:
             try:
@@ -358,12 +575,12 @@ Solo retorna el JSON puro, nada más."""
             nombre = p.get("nombre", "").upper().strip()
             
             # Skip invalid names
-            if not nombre or nombre in ("NULL", "NONE", "NO VISIBLE", "NO LEGIBLE"):
+            if nombre in _INVALID_NAMES:
                 continue
             
             # Create a key based on name (normalized)
             # Remove common variations to catch more duplicates
-            key = re.sub(r'\s+', ' ', nombre)  # Normalize spaces
+            key = " ".join(nombre.split())  # Normalize spaces
             
             if key not in seen:
                 seen.add(key)
@@ -376,18 +593,28 @@ Solo retorna el JSON puro, nada más."""
     
     def _parse_price(self, price: Any) -> Optional[float]:
         """Parse price from various formats to float"""
-        if price is None or price == "No visible" or price == "null":
-            return None
-        
-        if isinstance(price, (int, float)):
+        # Caso común primero: Gemini casi siempre devuelve el precio como número
+        price_type = type(price)
+        if price_type is float:
+            return price
+        if price_type is int:
             return float(price)
         
+        if price is None:
+            return None
+        
         if isinstance(price, str):
+            if price in _PRICE_NULL_STRINGS:
+                return None
             # Remover símbolos de moneda y espacios
-            cleaned = re.sub(r'[^\d.]', '', price)
+            cleaned = _NON_NUMERIC_RE.sub('', price)
             try:
                 return float(cleaned) if cleaned else None
             except ValueError:
                 return None
         
+        # Other numeric types (bool, numpy scalars)
+        if isinstance(price, (int, float)):
+            return float(price)
+        
         return None
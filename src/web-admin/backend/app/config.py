@@ -13,6 +13,10 @@ class Settings(BaseSettings):
     JWT_SECRET_KEY: str = "your-super-secret-jwt-key-change-in-production"
     JWT_ALGORITHM: str = "HS256"
     JWT_EXPIRATION_HOURS: int = 24
+    JWT_CACHE_TTL: float = 5.0  # Seconds a verified token is served from memory (0 = off)
+    
+    # Password hashing (bcrypt cost factor; each +1 doubles the hashing time)
+    BCRYPT_ROUNDS: int = 12
     
     # Encryption
     ENCRYPTION_KEY: str = "your-32-byte-encryption-key-here"
@@ -27,7 +31,46 @@ class Settings(BaseSettings):
     # Qdrant Configuration
     QDRANT_HOST: str = "qdrant"
     QDRANT_PORT: int = 6333
+    QDRANT_GRPC_PORT: int = 6334
+    QDRANT_PREFER_GRPC: bool = True
     QDRANT_COLLECTION: str = "products"
+    QDRANT_UPSERT_BATCH_SIZE: int = 64
+    QDRANT_UPSERT_CONCURRENCY: int = 4  # Upsert requests in flight per indexing call
+    QDRANT_BULK_LOAD_MIN_POINTS: int = 5000  # HNSW indexing is paused while larger files load (per replica)
+    
+    # Product-name embeddings kept in memory across uploads (0 disables the cache)
+    EMBEDDING_CACHE_SIZE: int = 20000
+    EMBEDDING_THREADS: int = 0  # CPU threads for the embedding model (0 = library default)
+    # Compile the PyTorch encoder with torch.compile (TorchInductor). Compilation
+    # happens during the startup warm-up and needs a C++ compiler in the image
+    # (python:3.11-slim has none); benchmark before enabling
+    EMBEDDING_TORCH_COMPILE: bool = False
+    
+    # Directory of an ONNX export of the embedding model, run with ONNX Runtime
+    # instead of PyTorch. Empty = PyTorch. Needs requirements-onnx.txt (build the
+    # image with WITH_ONNX=true). Export it once with:
+    #   optimum-cli export onnx --model sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2 \
+    #       --task feature-extraction --optimize O2 data/minilm_onnx
+    EMBEDDING_ONNX_PATH: str = ""
+    # Graph file inside EMBEDDING_ONNX_PATH. For the INT8 (VNNI) variant run
+    #   optimum-cli onnxruntime quantize --onnx_model data/minilm_onnx --avx512_vnni -o data/minilm_int8
+    # then point EMBEDDING_ONNX_PATH there and set "model_quantized.onnx".
+    # The agent embeds queries in FP32, so compare similarities on a sample of
+    # names before indexing with INT8; set back to "model.onnx" to fall back
+    EMBEDDING_ONNX_FILE: str = "model.onnx"
+    
+    # CORS: origins allowed to call the API from another host, comma-separated.
+    # Empty = no CORS headers (the frontend is served from this same origin)
+    ADMIN_FRONTEND_ORIGIN: str = ""
+    
+    # PDF page extraction processes (0 = one per CPU)
+    PDF_WORKERS: int = 0
+    
+    # File registry (SQLite, persisted on the web-admin-data volume)
+    REGISTRY_DB_PATH: str = "data/registry.db"
+    
+    # Embeddings of indexed names, kept across restarts (empty = memory cache only)
+    EMBEDDING_CACHE_DB_PATH: str = "data/embeddings.db"
     
     # Admin Credentials
     ADMIN_USERNAME: str = "admin"
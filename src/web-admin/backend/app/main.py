@@ -2,17 +2,21 @@
 Web Admin Backend - FastAPI Application
 Provides REST API for file management and product indexing.
 """
+import asyncio
+import hashlib
 import logging
 import sys
+import tempfile
 from datetime import timedelta
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from contextlib import asynccontextmanager
+from functools import lru_cache
 
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form, Query
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form, Query, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 from pydantic import BaseModel
 import os
 
@@ -24,6 +28,7 @@ from app.security import (
 from app.services.minio_service import MinIOService
 from app.services.file_processor import FileProcessor
 from app.services.qdrant_service import QdrantAdminService
+from app.services.file_registry import FileRegistry
 
 # Configure logging
 logging.basicConfig(
@@ -36,13 +41,15 @@ logger = logging.getLogger(__name__)
 # Security
 security = HTTPBearer()
 
+# Uploads are read in 1 MB chunks and kept in memory up to 16 MB
+_UPLOAD_CHUNK_SIZE = 1 << 20
+_UPLOAD_SPOOL_MAX_MEMORY = 16 << 20
+
 # Services (initialized on startup)
 minio_service: Optional[MinIOService] = None
 file_processor: Optional[FileProcessor] = None
 qdrant_service: Optional[QdrantAdminService] = None
-
-# In-memory file registry (in production, use a database)
-file_registry = {}
+file_registry: Optional[FileRegistry] = None
 
 
 # Pydantic models
@@ -105,7 +112,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifecycle"""
-    global minio_service, file_processor, qdrant_service
+    global minio_service, file_processor, qdrant_service, file_registry
     
     logger.info("🚀 Starting Web Admin Backend...")
     
@@ -118,30 +125,35 @@ async def lifespan(app: FastAPI):
         
         logger.info("Initializing Qdrant Service...")
         qdrant_service = QdrantAdminService()
+        await asyncio.to_thread(qdrant_service.warm_up)
+        
+        logger.info("Opening File Registry...")
+        file_registry = FileRegistry()
         
-        # Load existing file registry from Qdrant
-        await _load_file_registry()
+        # First start with an empty registry: recover the files already in Qdrant
+        if await file_registry.count() == 0:
+            await _bootstrap_file_registry()
         
         logger.info("✅ Web Admin Backend ready!")
         yield
-        
+    
     except Exception as e:
         logger.error(f"❌ Failed to initialize: {e}", exc_info=True)
         raise
     
     logger.info("👋 Shutting down Web Admin Backend...")
+    file_registry.close()
+    file_processor.close()
+    await qdrant_service.close()
 
 
-async def _load_file_registry():
-    """Load file registry from Qdrant on startup"""
-    global file_registry
-    
+async def _bootstrap_file_registry():
+    """Seed an empty registry with the files found in Qdrant (one-time migration)"""
     try:
-        file_ids = await qdrant_service.get_unique_file_ids()
-        for file_id in file_ids:
-            count = await qdrant_service.count_by_file(file_id)
-            # Basic info - in production, store in database
-            file_registry[file_id] = {
+        counts = await qdrant_service.file_counts()
+        # Only the id and count are known for files indexed before the registry existed
+        files = [
+            {
                 "file_id": file_id,
                 "filename": f"{file_id}.data",
                 "size": 0,
@@ -150,27 +162,42 @@ async def _load_file_registry():
                 "uploaded_at": "unknown",
                 "status": "indexed"
             }
-        logger.info(f"Loaded {len(file_registry)} files from registry")
+            for file_id, count in counts.items()
+        ]
+        await file_registry.put_many(files)
+        logger.info(f"Loaded {len(files)} files from Qdrant into the registry")
     except Exception as e:
         logger.warning(f"Could not load file registry: {e}")
 
 
+async def _refresh_product_counts(file_ids: List[str]):
+    """Refresh the stored product counts from Qdrant (runs after the response)"""
+    try:
+        counts = await qdrant_service.counts_by_files(file_ids)
+        await file_registry.update_counts(counts)
+    except Exception as e:
+        logger.warning(f"Could not refresh product counts: {e}")
+
+
 # FastAPI app
 app = FastAPI(
     title="A-Patricia Web Admin",
     description="File management and product indexing for A-Patricia",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse  # orjson serializes large payloads much faster
 )
 
-# CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# CORS (only needed when the frontend is hosted on another origin)
+_cors_origins = [o.strip() for o in settings.ADMIN_FRONTEND_ORIGIN.split(",") if o.strip()]
+if _cors_origins:
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=_cors_origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
 
 
 # ============================================
@@ -233,82 +260,114 @@ async def upload_file(
     if not file.filename:
         raise HTTPException(status_code=400, detail="No filename provided")
     
-    # Read file
-    file_data = await file.read()
-    if len(file_data) == 0:
+    # Copy the upload in 1 MB chunks into a spool (in memory up to 16 MB, then on disk)
+    spool = tempfile.SpooledTemporaryFile(max_size=_UPLOAD_SPOOL_MAX_MEMORY)
+    file_size = 0
+    hasher = hashlib.sha256()
+    while chunk := await file.read(_UPLOAD_CHUNK_SIZE):
+        spool.write(chunk)
+        file_size += len(chunk)
+        hasher.update(chunk)
+    await file.close()
+    if file_size == 0:
+        spool.close()
         raise HTTPException(status_code=400, detail="Empty file")
     
     # Generate file ID
     file_id = generate_file_id()
     
     try:
-        # Process file to extract products
+        # Extract products and index them batch by batch (only one batch in memory)
         logger.info(f"Processing file: {file.filename}")
-        products, metadata = await file_processor.process_file(
-            file_data,
-            file.filename,
-            file.content_type or "application/octet-stream"
-        )
-        
-        # Add tienda_id to all products if provided
-        if tienda_id:
-            for product in products:
-                if not product.get("tienda_id"):
-                    product["tienda_id"] = tienda_id
+        metadata: Dict[str, Any] = {}
+        index_result = {"indexed": 0, "errors": 0}
+        row = 0
+        bulk_load = False
+        try:
+            async for products in file_processor.stream_products(
+                spool,
+                file.filename,
+                file.content_type or "application/octet-stream",
+                metadata
+            ):
+                # Large file: pause HNSW indexing for the rest of the load
+                if not bulk_load and row >= settings.QDRANT_BULK_LOAD_MIN_POINTS:
+                    bulk_load = True
+                    await qdrant_service.begin_bulk_load()
+                
+                # Add tienda_id to all products if provided
+                if tienda_id:
+                    for product in products:
+                        if not product.get("tienda_id"):
+                            product["tienda_id"] = tienda_id
+                
+                batch_result = await qdrant_service.index_products(products, file_id, start_index=row)
+                row += len(products)
+                index_result["indexed"] += batch_result["indexed"]
+                index_result["errors"] += batch_result["errors"]
+        finally:
+            if bulk_load:
+                await qdrant_service.end_bulk_load()
         
-        # Upload original file to MinIO
-        await minio_service.upload_file(
+        # Stream the original from the spool to MinIO
+        spool.seek(0)
+        await minio_service.upload_stream(
             file_id=file_id,
-            file_data=file_data,
+            stream=spool,
+            length=file_size,
             filename=file.filename,
             content_type=file.content_type or "application/octet-stream"
         )
         
-        # Index products in Qdrant
-        index_result = await qdrant_service.index_products(products, file_id)
-        
         # Store in registry
         from datetime import datetime
         file_info = {
             "file_id": file_id,
             "filename": file.filename,
-            "size": len(file_data),
+            "size": file_size,
+            "sha256": hasher.hexdigest(),
             "content_type": file.content_type or "application/octet-stream",
             "products_count": index_result["indexed"],
             "uploaded_at": datetime.utcnow().isoformat(),
             "status": "indexed",
             "metadata": metadata
         }
-        file_registry[file_id] = file_info
+        await file_registry.put(file_info)
         
         # Encrypt response data
         response_data = {
             "file_id": file_id,
             "filename": file.filename,
-            "products_extracted": len(products),
+            "products_extracted": metadata["total_products"],
             "products_indexed": index_result["indexed"],
             "errors": index_result["errors"],
             "metadata": metadata
         }
         
         return EncryptedResponse(data=encrypt_data(response_data))
-        
+    
     except Exception as e:
         logger.error(f"Error processing file: {e}", exc_info=True)
-        # Cleanup on error
+        # Cleanup on error (batches indexed before the failure included)
         await minio_service.delete_folder(file_id)
+        await qdrant_service.delete_by_file(file_id)
         raise HTTPException(status_code=500, detail=str(e))
+    
+    finally:
+        spool.close()
 
 
 @app.get("/api/files", response_model=EncryptedResponse)
-async def list_files(user: dict = Depends(get_current_user)):
+async def list_files(
+    background_tasks: BackgroundTasks,
+    user: dict = Depends(get_current_user)
+):
     """List all uploaded files"""
-    files = list(file_registry.values())
+    files = await file_registry.list_all()
     
-    # Update product counts from Qdrant
-    for f in files:
-        count = await qdrant_service.count_by_file(f["file_id"])
-        f["products_count"] = count
+    # Serve the stored counts; refresh them from Qdrant after responding
+    if files:
+        background_tasks.add_task(_refresh_product_counts, [f["file_id"] for f in files])
     
     response_data = {
         "files": files,
@@ -321,14 +380,14 @@ async def list_files(user: dict = Depends(get_current_user)):
 @app.get("/api/files/{file_id}")
 async def get_file_info(file_id: str, user: dict = Depends(get_current_user)):
     """Get file information"""
-    if file_id not in file_registry:
+    file_info = await file_registry.get(file_id)
+    if file_info is None:
         raise HTTPException(status_code=404, detail="File not found")
     
-    file_info = file_registry[file_id]
-    
     # Update product count
     count = await qdrant_service.count_by_file(file_id)
     file_info["products_count"] = count
+    await file_registry.update_counts({file_id: count})
     
     return EncryptedResponse(data=encrypt_data(file_info))
 
@@ -336,20 +395,20 @@ async def get_file_info(file_id: str, user: dict = Depends(get_current_user)):
 @app.delete("/api/files/{file_id}")
 async def delete_file(file_id: str, user: dict = Depends(get_current_user)):
     """Delete a file and its indexed products"""
-    if file_id not in file_registry:
+    file_info = await file_registry.get(file_id)
+    if file_info is None:
         raise HTTPException(status_code=404, detail="File not found")
     
-    file_info = file_registry[file_id]
-    
     try:
-        # Delete from Qdrant
-        deleted_products = await qdrant_service.delete_by_file(file_id)
+        # Delete from Qdrant (the registry holds the file's product count)
+        deleted = await qdrant_service.delete_by_file(file_id)
+        deleted_products = file_info.get("products_count", 0) if deleted else 0
         
         # Delete from MinIO
         await minio_service.delete_folder(file_id)
         
         # Remove from registry
-        del file_registry[file_id]
+        await file_registry.delete(file_id)
         
         response_data = {
             "file_id": file_id,
@@ -359,7 +418,7 @@ async def delete_file(file_id: str, user: dict = Depends(get_current_user)):
         }
         
         return EncryptedResponse(data=encrypt_data(response_data))
-        
+    
     except Exception as e:
         logger.error(f"Error deleting file: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -372,16 +431,20 @@ async def get_file_preview(
     user: dict = Depends(get_current_user)
 ):
     """Get preview of indexed products from a file"""
-    if file_id not in file_registry:
+    if await file_registry.get(file_id) is None:
         raise HTTPException(status_code=404, detail="File not found")
     
-    products = await qdrant_service.get_products_by_file(file_id, limit)
+    # Both lookups go out at once (two concurrent requests, not two sequential ones)
+    products, total = await asyncio.gather(
+        qdrant_service.get_products_by_file(file_id, limit),
+        qdrant_service.count_by_file(file_id)
+    )
     
     response_data = {
         "file_id": file_id,
         "products": products,
         "count": len(products),
-        "total": await qdrant_service.count_by_file(file_id)
+        "total": total
     }
     
     return EncryptedResponse(data=encrypt_data(response_data))
@@ -390,11 +453,10 @@ async def get_file_preview(
 @app.get("/api/files/{file_id}/download")
 async def download_file(file_id: str, user: dict = Depends(get_current_user)):
     """Get presigned URL to download original file"""
-    if file_id not in file_registry:
+    file_info = await file_registry.get(file_id)
+    if file_info is None:
         raise HTTPException(status_code=404, detail="File not found")
     
-    file_info = file_registry[file_id]
-    
     try:
         url = await minio_service.get_presigned_url(
             file_id,
@@ -409,7 +471,7 @@ async def download_file(file_id: str, user: dict = Depends(get_current_user)):
         }
         
         return EncryptedResponse(data=encrypt_data(response_data))
-        
+    
     except Exception as e:
         logger.error(f"Error generating download URL: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -426,7 +488,7 @@ async def get_stats(user: dict = Depends(get_current_user)):
     
     response_data = {
         "total_products": qdrant_stats["total_products"],
-        "total_files": len(file_registry),
+        "total_files": await file_registry.count(),
         "qdrant_status": qdrant_stats["status"]
     }
     
@@ -455,27 +517,49 @@ async def decrypt_response(
 # ============================================
 
 # Serve static files from the built React app
-STATIC_DIR = os.path.join(os.path.dirname(__file__), "..", "static")
+STATIC_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), "..", "static"))
+
+
+class AssetFiles(StaticFiles):
+    """Vite bundles: file names carry a content hash, so browsers may cache them forever"""
+    
+    async def get_response(self, path: str, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code == 200:
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+
+@lru_cache(maxsize=4096)
+def _resolve_static_file(full_path: str) -> Optional[str]:
+    """Path of a built frontend file, None if it doesn't exist (the build is fixed per deploy)"""
+    file_path = os.path.realpath(os.path.join(STATIC_DIR, full_path))
+    # Never serve anything outside the build directory ("../" or absolute paths)
+    if not file_path.startswith(STATIC_DIR + os.sep):
+        return None
+    return file_path if os.path.isfile(file_path) else None
+
 
 if os.path.exists(STATIC_DIR):
-    app.mount("/assets", StaticFiles(directory=os.path.join(STATIC_DIR, "assets")), name="assets")
+    app.mount("/assets", AssetFiles(directory=os.path.join(STATIC_DIR, "assets")), name="assets")
+    
+    INDEX_PATH = _resolve_static_file("index.html")
     
     @app.get("/{full_path:path}")
     async def serve_spa(full_path: str):
         """Serve the React SPA for all non-API routes"""
-        # Don't serve for API routes
-        if full_path.startswith("api/"):
+        # Unknown API routes get a 404 before any filesystem work
+        if full_path == "api" or full_path.startswith("api/"):
             raise HTTPException(status_code=404, detail="Not found")
         
         # Try to serve the requested file
-        file_path = os.path.join(STATIC_DIR, full_path)
-        if os.path.isfile(file_path):
+        file_path = _resolve_static_file(full_path)
+        if file_path is not None:
             return FileResponse(file_path)
         
         # Fall back to index.html for SPA routing
-        index_path = os.path.join(STATIC_DIR, "index.html")
-        if os.path.exists(index_path):
-            return FileResponse(index_path)
+        if INDEX_PATH is not None:
+            return FileResponse(INDEX_PATH)
         
         raise HTTPException(status_code=404, detail="Not found")
 
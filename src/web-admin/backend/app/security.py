@@ -3,57 +3,54 @@ Security utilities: JWT tokens and encryption
 """
 import base64
 import hashlib
-import secrets
+import os
+import threading
+import time
 from datetime import datetime, timedelta
 from typing import Optional
-import json
 
-from jose import JWTError, jwt
-from passlib.context import CryptContext
-from cryptography.fernet import Fernet
+import orjson
+from cachetools import TTLCache
+
+import bcrypt
+import jwt
+from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 
 from app.config import settings
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 
 def get_encryption_key() -> bytes:
-    """Derive a valid Fernet key from the encryption key setting"""
+    """Derive a 32-byte cipher key from the encryption key setting"""
     key = settings.ENCRYPTION_KEY.encode()
-    # Use PBKDF2 to derive a valid 32-byte key
-    kdf = PBKDF2HMAC(
+    # HKDF: the input is a server-side secret, not a password, so a
+    # one-shot extract+expand is enough (no iteration count to pay for)
+    kdf = HKDF(
         algorithm=hashes.SHA256(),
         length=32,
         salt=b"patricia-salt-v1",  # Static salt for consistency
-        iterations=100000,
+        info=b"payload-cipher",
     )
-    derived_key = base64.urlsafe_b64encode(kdf.derive(key))
-    return derived_key
+    return kdf.derive(key)
 
 
-# Encryption cipher
-_fernet = None
+# Encryption cipher (AEAD; one FFI call per encrypt/decrypt). Built at import
+# so the key derivation never runs inside a request
+_CIPHER = ChaCha20Poly1305(get_encryption_key())
 
-
-def get_fernet() -> Fernet:
-    """Get or create Fernet cipher"""
-    global _fernet
-    if _fernet is None:
-        _fernet = Fernet(get_encryption_key())
-    return _fernet
+# ChaCha20-Poly1305 nonce size in bytes
+_NONCE_SIZE = 12
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash"""
-    return pwd_context.verify(plain_password, hashed_password)
+    """Verify a password against its bcrypt hash"""
+    return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
 
 
 def hash_password(password: str) -> str:
-    """Hash a password"""
-    return pwd_context.hash(password)
+    """Hash a password with bcrypt (cost = BCRYPT_ROUNDS)"""
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)).decode()
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -75,33 +72,60 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 
+# Recently verified tokens: sha256(token) -> (payload, exp). Only valid
+# tokens are cached, and never past their own expiry
+_token_cache = TTLCache(maxsize=10_000, ttl=settings.JWT_CACHE_TTL)
+_token_cache_lock = threading.Lock()
+
+
 def verify_token(token: str) -> Optional[dict]:
-    """Verify and decode a JWT token"""
+    """Verify and decode a JWT token (recent verifications are cached)"""
+    key = hashlib.sha256(token.encode()).digest()
+    now = time.time()
+    
+    with _token_cache_lock:
+        cached = _token_cache.get(key)
+    if cached is not None and cached[1] > now:
+        return dict(cached[0])
+    
     try:
         payload = jwt.decode(
             token, 
             settings.JWT_SECRET_KEY, 
             algorithms=[settings.JWT_ALGORITHM]
         )
-        return payload
-    except JWTError:
+    except jwt.PyJWTError:
         return None
+    
+    exp = payload.get("exp")
+    if settings.JWT_CACHE_TTL > 0 and isinstance(exp, (int, float)):
+        with _token_cache_lock:
+            _token_cache[key] = (dict(payload), exp)
+    return payload
 
 
 def encrypt_data(data: dict) -> str:
-    """Encrypt data dictionary to string"""
-    json_data = json.dumps(data)
-    encrypted = get_fernet().encrypt(json_data.encode())
-    return base64.urlsafe_b64encode(encrypted).decode()
+    """Encrypt data dictionary to string (base64url of nonce + ciphertext)"""
+    json_data = orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    nonce = os.urandom(_NONCE_SIZE)
+    encrypted = _CIPHER.encrypt(nonce, json_data, None)
+    return base64.urlsafe_b64encode(nonce + encrypted).decode()
 
 
 def decrypt_data(encrypted_str: str) -> dict:
     """Decrypt string to data dictionary"""
     encrypted = base64.urlsafe_b64decode(encrypted_str.encode())
-    decrypted = get_fernet().decrypt(encrypted)
-    return json.loads(decrypted.decode())
+    decrypted = _CIPHER.decrypt(encrypted[:_NONCE_SIZE], encrypted[_NONCE_SIZE:], None)
+    return orjson.loads(decrypted)
 
 
 def generate_file_id() -> str:
-    """Generate a unique file ID"""
-    return secrets.token_urlsafe(16)
+    """
+    Generate a unique, time-ordered file ID (UUIDv7 as 32 hex chars).
+    Newer uploads sort after older ones, so MinIO keys keep upload order.
+    """
+    # 48-bit Unix ms timestamp | version 7 | 12 random bits | variant | 62 random bits
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(os.urandom(10), "big")
+    value = (value & ~(0xF << 76)) | (0x7 << 76)
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)
+    return f"{value:032x}"
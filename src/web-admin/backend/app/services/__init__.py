@@ -2,3 +2,5 @@
 from app.services.minio_service import MinIOService
 from app.services.file_processor import FileProcessor
 from app.services.qdrant_service import QdrantAdminService
+from app.services.file_registry import FileRegistry
+from app.services.embedding_cache import EmbeddingCache
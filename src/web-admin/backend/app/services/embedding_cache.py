@@ -0,0 +1,90 @@
+"""
+Persistent embedding cache for the Web Admin.
+Stores product-name embeddings in a local SQLite database (WAL mode) so
+re-indexing a file after a restart doesn't re-encode names seen before.
+"""
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    hash BLOB NOT NULL,
+    vec BLOB NOT NULL,
+    PRIMARY KEY (model, hash)
+) WITHOUT ROWID
+"""
+
+# Keys per SELECT (SQLite caps the number of bound parameters)
+_LOOKUP_CHUNK = 500
+
+
+class EmbeddingCache:
+    """
+    Disk-backed map of (model, name digest) -> float32 embedding.
+    Used from the encoding worker threads, so calls are serialized with
+    a lock on a single connection.
+    """
+    
+    def __init__(self, model: str, db_path: str = settings.EMBEDDING_CACHE_DB_PATH):
+        """
+        Open (or create) the cache database.
+        
+        Args:
+            model: Identifies the encoder; vectors of other models are ignored
+            db_path: SQLite database file
+        """
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self.model = model
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(_SCHEMA)
+        self.conn.commit()
+        
+        logger.info(f"✅ EmbeddingCache initialized ({db_path}, model={model})")
+    
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self.conn.close()
+    
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """Look up embeddings by name digest; missing keys are absent from the result"""
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _LOOKUP_CHUNK):
+                chunk = keys[start:start + _LOOKUP_CHUNK]
+                rows = self.conn.execute(
+                    f"SELECT hash, vec FROM embeddings WHERE model = ? "
+                    f"AND hash IN ({', '.join('?' * len(chunk))})",
+                    (self.model, *chunk)
+                ).fetchall()
+                for key, vec in rows:
+                    found[key] = np.frombuffer(vec, dtype=np.float32)
+        return found
+    
+    def put_many(self, items: Iterable[Tuple[bytes, np.ndarray]]):
+        """Store embeddings (keys already present are left as they are)"""
+        values = [
+            (self.model, key, np.asarray(vec, dtype=np.float32).tobytes())
+            for key, vec in items
+        ]
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, hash, vec) VALUES (?, ?, ?)",
+                values
+            )
@@ -2,16 +2,138 @@
 File processor service for extracting product data from various file formats.
 Supports: CSV, Excel, PDF, Images, TXT, DOCX
 """
+import asyncio
+import codecs
 import logging
 import io
+import multiprocessing
+import os
 import re
-from typing import List, Dict, Any, Optional, Tuple
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import AsyncIterator, BinaryIO, Iterable, Iterator, List, Dict, Any, Optional, Tuple, Union
 from pathlib import Path
 
 import pandas as pd
+from charset_normalizer import from_bytes
+
+from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+# pyarrow's multithreaded CSV reader is used when installed
+try:
+    import pyarrow  # noqa: F401
+    _HAS_PYARROW = True
+except ImportError:
+    _HAS_PYARROW = False
+
+
+# Free-text product lines, tried in order: "Name - $12.50" / "Name: 12.50", then "Name $12.50".
+# (.+?) can absorb any prefix, so a match always starts at the beginning of the line
+_TEXT_PRICE_PATTERNS = (
+    re.compile(r'(.+?)\s*[-:]\s*\$?(\d+\.?\d*)'),
+    re.compile(r'(.+?)\s+\$(\d+\.?\d*)'),
+)
+
+# Encodings tried, in order, after the detected one
+_FALLBACK_ENCODINGS = ('utf-8', 'latin-1', 'cp1252')
+
+# Bytes inspected to detect the encoding
+_ENCODING_SAMPLE_SIZE = 65536
+
+
+def _candidate_encodings(data: bytes) -> List[str]:
+    """
+    Encodings to try for a text upload, most likely first.
+    Only the first 64 KB are inspected, so the file is normally decoded once.
+    """
+    if data.startswith(codecs.BOM_UTF8):
+        detected = 'utf-8-sig'
+    else:
+        sample = data[:_ENCODING_SAMPLE_SIZE]
+        try:
+            # final=False: a character cut at the sample boundary is not an error
+            codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+            detected = 'utf-8'
+        except UnicodeDecodeError:
+            best = from_bytes(sample, cp_isolation=['cp1252', 'latin_1']).best()
+            detected = best.encoding.replace('_', '-') if best is not None else 'cp1252'
+    
+    return [detected] + [enc for enc in _FALLBACK_ENCODINGS if enc != detected]
+
+
+# Worker processes for PDF page extraction (created on the first large PDF)
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+
+# PDFs with at most this many pages per worker are parsed in a single thread
+_PDF_MIN_PAGES_PER_TASK = 8
+
+
+def _pdf_workers() -> int:
+    """Number of PDF worker processes"""
+    return settings.PDF_WORKERS or os.cpu_count() or 1
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    """Get or create the PDF worker pool"""
+    global _pdf_pool
+    if _pdf_pool is None:
+        # spawn: forking a process that holds gRPC channels and threads is unsafe
+        _pdf_pool = ProcessPoolExecutor(
+            max_workers=_pdf_workers(),
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pdf_pool
+
+
+def _count_pdf_pages(pdf: Union[str, BinaryIO]) -> int:
+    """Number of pages in a PDF (path or binary file object)"""
+    import pdfplumber
+    
+    with pdfplumber.open(pdf) as doc:
+        return len(doc.pages)
+
+
+def _extract_pdf_pages(pdf: Union[str, BinaryIO], start: int, stop: int) -> List[Tuple[list, Optional[str]]]:
+    """
+    Tables and text of pages [start, stop).
+    Top-level so it can run in a worker process (pdfplumber objects can't be
+    pickled, so each worker reopens the PDF from its path).
+    """
+    import pdfplumber
+    
+    with pdfplumber.open(pdf) as doc:
+        return [(page.extract_tables(), page.extract_text()) for page in doc.pages[start:stop]]
+
+
+def _read_head(file: BinaryIO) -> bytes:
+    """First bytes of a file, for encoding detection (the file is rewound)"""
+    file.seek(0)
+    head = file.read(_ENCODING_SAMPLE_SIZE)
+    file.seek(0)
+    return head
+
+
+def _read_csv(file: BinaryIO, **kwargs) -> pd.DataFrame:
+    """
+    Parse delimited text with pyarrow when available, else pandas' C engine.
+    Anything pyarrow rejects is retried with the C engine, which also
+    reports bad encodings as UnicodeDecodeError. Row-limited reads (nrows)
+    go straight to the C engine, since pyarrow would parse the whole file.
+    The file is read from the start on every attempt.
+    """
+    if _HAS_PYARROW and "nrows" not in kwargs:
+        try:
+            file.seek(0)
+            return pd.read_csv(file, engine="pyarrow", **kwargs)
+        except Exception as e:
+            logger.debug(f"pyarrow CSV parse failed, retrying with the C engine: {e}")
+    file.seek(0)
+    return pd.read_csv(file, engine="c", low_memory=False, **kwargs)
+
 
 class FileProcessor:
     """
@@ -42,12 +164,26 @@ class FileProcessor:
         'presentacion': ['presentacion', 'size', 'tamaño', 'unidad', 'unit', 'gramaje', 'peso', 'weight'],
     }
     
+    # Reverse lookup: alias -> (standardized name, priority within its aliases)
+    ALIAS_TO_STANDARD = {
+        alias: (standard_name, rank)
+        for standard_name, possible_names in COLUMN_MAPPINGS.items()
+        for rank, alias in enumerate(possible_names)
+    }
+    
     def __init__(self):
         logger.info("✅ FileProcessor initialized")
     
+    def close(self):
+        """Stop the PDF worker processes, if any were started"""
+        global _pdf_pool
+        if _pdf_pool is not None:
+            _pdf_pool.shutdown(wait=False, cancel_futures=True)
+            _pdf_pool = None
+    
     async def process_file(
         self,
-        file_data: bytes,
+        file_data: Union[bytes, BinaryIO],
         filename: str,
         content_type: str
     ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
@@ -55,47 +191,136 @@ class FileProcessor:
         Process a file and extract product data.
         
         Args:
-            file_data: File content as bytes
+            file_data: File content, as bytes or a seekable binary file
             filename: Original filename
             content_type: MIME type
-            
+        
         Returns:
             Tuple of (list of products, metadata dict)
         """
+        products, metadata = await self._parse_file(file_data, filename, content_type)
+        products = list(products)
+        metadata["total_products"] = len(products)
+        return products, metadata
+    
+    async def stream_products(
+        self,
+        file_data: Union[bytes, BinaryIO],
+        filename: str,
+        content_type: str,
+        metadata: Dict[str, Any],
+        batch_size: int = settings.QDRANT_UPSERT_BATCH_SIZE * settings.QDRANT_UPSERT_CONCURRENCY
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Process a file and yield its products in batches.
+        Tabular rows are converted lazily, so only one batch of product
+        dicts is alive at a time.
+        
+        Args:
+            file_data: File content, as bytes or a seekable binary file
+            filename: Original filename
+            content_type: MIME type
+            metadata: Filled with the file metadata; "total_products" is set
+                once the last batch has been yielded
+            batch_size: Products per batch (default: enough upsert batches
+                to fill every concurrent upsert slot)
+        
+        Yields:
+            Lists of up to batch_size products
+        """
+        products, parsed = await self._parse_file(file_data, filename, content_type)
+        metadata.update(parsed)
+        
+        total = 0
+        products = iter(products)
+        while batch := list(islice(products, batch_size)):
+            total += len(batch)
+            yield batch
+        
+        metadata["total_products"] = total
+    
+    async def preview_file(
+        self,
+        file_data: Union[bytes, BinaryIO],
+        filename: str,
+        content_type: str,
+        limit: int = 100
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Extract only the first products of a file, for display.
+        CSV and Excel files are read up to `limit` rows, so memory and time
+        don't grow with the file size.
+        
+        Args:
+            file_data: File content, as bytes or a seekable binary file
+            filename: Original filename
+            content_type: MIME type
+            limit: Max products returned
+        
+        Returns:
+            Tuple of (up to `limit` products, metadata dict)
+        """
+        products, metadata = await self._parse_file(
+            file_data, filename, content_type, max_rows=limit
+        )
+        return self.get_preview_data(products, limit), metadata
+    
+    async def _parse_file(
+        self,
+        file_data: Union[bytes, BinaryIO],
+        filename: str,
+        content_type: str,
+        max_rows: Optional[int] = None
+    ) -> Tuple[Iterable[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Dispatch on the file extension.
+        Parsers read from a file object, so large uploads can stay on disk.
+        
+        Args:
+            max_rows: Read at most this many data rows (CSV/Excel only)
+        
+        Returns:
+            Tuple of (products, metadata dict); tabular formats return a
+            lazy iterator of products
+        """
         extension = Path(filename).suffix.lower().lstrip('.')
         
         logger.info(f"Processing file: {filename} ({content_type})")
         
+        file = io.BytesIO(file_data) if isinstance(file_data, (bytes, bytearray)) else file_data
+        file.seek(0)
+        
         try:
             if extension in ('csv',):
-                return await self._process_csv(file_data, filename)
+                return await self._process_csv(file, filename, max_rows)
             elif extension in ('xlsx', 'xls'):
-                return await self._process_excel(file_data, filename)
+                return await self._process_excel(file, filename, max_rows)
             elif extension == 'pdf':
-                return await self._process_pdf(file_data, filename)
+                return await self._process_pdf(file, filename)
             elif extension in ('txt',):
-                return await self._process_txt(file_data, filename)
+                return await self._process_txt(file, filename)
             elif extension in ('docx', 'doc'):
-                return await self._process_docx(file_data, filename)
+                return await self._process_docx(file, filename)
             elif extension in ('png', 'jpg', 'jpeg'):
-                return await self._process_image(file_data, filename)
+                return await self._process_image(file, filename)
             else:
                 raise ValueError(f"Unsupported file format: {extension}")
-                
+        
         except Exception as e:
             logger.error(f"Error processing file {filename}: {e}")
             raise
     
     async def _process_csv(
         self, 
-        file_data: bytes, 
-        filename: str
-    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        file: BinaryIO, 
+        filename: str,
+        max_rows: Optional[int] = None
+    ) -> Tuple[Iterable[Dict[str, Any]], Dict[str, Any]]:
         """Process CSV file"""
-        # Try different encodings
-        for encoding in ['utf-8', 'latin-1', 'cp1252']:
+        # Detected encoding first, then the others
+        for encoding in _candidate_encodings(_read_head(file)):
             try:
-                df = pd.read_csv(io.BytesIO(file_data), encoding=encoding)
+                df = _read_csv(file, encoding=encoding, nrows=max_rows)
                 break
             except UnicodeDecodeError:
                 continue
@@ -106,16 +331,17 @@ class FileProcessor:
     
     async def _process_excel(
         self, 
-        file_data: bytes, 
-        filename: str
-    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        file: BinaryIO, 
+        filename: str,
+        max_rows: Optional[int] = None
+    ) -> Tuple[Iterable[Dict[str, Any]], Dict[str, Any]]:
         """Process Excel file"""
-        df = pd.read_excel(io.BytesIO(file_data))
+        df = pd.read_excel(file, nrows=max_rows)
         return self._dataframe_to_products(df, filename)
     
     async def _process_pdf(
         self, 
-        file_data: bytes, 
+        file: BinaryIO, 
         filename: str
     ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
         """Process PDF file - extract tables or text"""
@@ -127,24 +353,21 @@ class FileProcessor:
         products = []
         all_text = []
         
-        with pdfplumber.open(io.BytesIO(file_data)) as pdf:
-            for page in pdf.pages:
-                # Try to extract tables first
-                tables = page.extract_tables()
-                for table in tables:
-                    if table and len(table) > 1:
-                        # Assume first row is header
-                        headers = [str(h).lower().strip() if h else '' for h in table[0]]
-                        for row in table[1:]:
-                            if row and any(cell for cell in row):
-                                product = self._map_row_to_product(headers, row)
-                                if product:
-                                    products.append(product)
-                
-                # Also extract text
-                text = page.extract_text()
-                if text:
-                    all_text.append(text)
+        for tables, text in await self._extract_pdf(file):
+            # Try to extract tables first
+            for table in tables:
+                if table and len(table) > 1:
+                    # Assume first row is header
+                    headers = [str(h).lower().strip() if h else '' for h in table[0]]
+                    for row in table[1:]:
+                        if row and any(cell for cell in row):
+                            product = self._map_row_to_product(headers, row)
+                            if product:
+                                products.append(product)
+            
+            # Also extract text
+            if text:
+                all_text.append(text)
         
         # If no tables found, try to parse text
         if not products and all_text:
@@ -159,14 +382,45 @@ class FileProcessor:
         
         return products, metadata
     
+    async def _extract_pdf(self, file: BinaryIO) -> List[Tuple[list, Optional[str]]]:
+        """
+        Extract (tables, text) for every page, in page order.
+        Large PDFs are split into page ranges parsed in parallel by worker
+        processes, which open a named temporary copy; small ones are parsed
+        in one worker thread straight from the file object.
+        """
+        page_count = await asyncio.to_thread(_count_pdf_pages, file)
+        workers = min(_pdf_workers(), page_count // _PDF_MIN_PAGES_PER_TASK)
+        
+        if workers <= 1:
+            return await asyncio.to_thread(_extract_pdf_pages, file, 0, page_count)
+        
+        # One contiguous page range per worker
+        step = -(-page_count // workers)
+        loop = asyncio.get_running_loop()
+        pool = _get_pdf_pool()
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as copy:
+            file.seek(0)
+            await asyncio.to_thread(shutil.copyfileobj, file, copy)
+            copy.flush()
+            chunks = await asyncio.gather(*(
+                loop.run_in_executor(pool, _extract_pdf_pages, copy.name, start, min(start + step, page_count))
+                for start in range(0, page_count, step)
+            ))
+        logger.info(f"Extracted {page_count} PDF pages with {len(chunks)} worker processes")
+        return [page for chunk in chunks for page in chunk]
+    
     async def _process_txt(
         self, 
-        file_data: bytes, 
+        file: BinaryIO, 
         filename: str
-    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    ) -> Tuple[Iterable[Dict[str, Any]], Dict[str, Any]]:
         """Process TXT file"""
-        # Try different encodings
-        for encoding in ['utf-8', 'latin-1', 'cp1252']:
+        # Free text is decoded whole, so this format is read into memory
+        file_data = file.read()
+        
+        # Detected encoding first, then the others
+        for encoding in _candidate_encodings(file_data):
             try:
                 text = file_data.decode(encoding)
                 break
@@ -183,11 +437,11 @@ class FileProcessor:
             first_line = lines[0]
             if '\t' in first_line:
                 # Tab separated
-                df = pd.read_csv(io.StringIO(text), sep='\t')
+                df = _read_csv(io.BytesIO(file_data), encoding=encoding, sep='\t')
                 return self._dataframe_to_products(df, filename)
             elif ',' in first_line and first_line.count(',') > 1:
                 # Comma separated
-                df = pd.read_csv(io.StringIO(text))
+                df = _read_csv(io.BytesIO(file_data), encoding=encoding)
                 return self._dataframe_to_products(df, filename)
         
         # Parse as free text
@@ -203,7 +457,7 @@ class FileProcessor:
     
     async def _process_docx(
         self, 
-        file_data: bytes, 
+        file: BinaryIO, 
         filename: str
     ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
         """Process DOCX file"""
@@ -212,7 +466,7 @@ class FileProcessor:
         except ImportError:
             raise ValueError("DOCX processing requires python-docx library")
         
-        doc = Document(io.BytesIO(file_data))
+        doc = Document(file)
         products = []
         
         # Extract tables
@@ -240,7 +494,7 @@ class FileProcessor:
     
     async def _process_image(
         self, 
-        file_data: bytes, 
+        file: BinaryIO, 
         filename: str
     ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
         """
@@ -263,18 +517,19 @@ class FileProcessor:
         self, 
         df: pd.DataFrame, 
         filename: str
-    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
-        """Convert DataFrame to list of product dicts"""
+    ) -> Tuple[Iterator[Dict[str, Any]], Dict[str, Any]]:
+        """Map DataFrame columns and return a lazy iterator of product dicts"""
         # Normalize column names
         df.columns = [str(c).lower().strip() for c in df.columns]
         
-        # Map columns
+        # Map columns (first matching column per standardized name)
         column_map = {}
-        for standard_name, possible_names in self.COLUMN_MAPPINGS.items():
-            for col in df.columns:
-                if col in possible_names:
-                    column_map[col] = standard_name
-                    break
+        mapped = set()
+        for col in df.columns:
+            entry = self.ALIAS_TO_STANDARD.get(col)
+            if entry is not None and entry[0] not in mapped:
+                column_map[col] = entry[0]
+                mapped.add(entry[0])
         
         # Check required columns
         mapped_cols = set(column_map.values())
@@ -291,58 +546,66 @@ class FileProcessor:
         # Rename columns
         df = df.rename(columns=column_map)
         
-        # Convert to products
-        products = []
-        for _, row in df.iterrows():
-            product = {}
-            
-            # Required: nombre
-            nombre = row.get('nombre', '')
-            if pd.isna(nombre) or not str(nombre).strip():
-                continue
-            product['nombre'] = str(nombre).strip().upper()
-            
-            # Optional: precio
-            precio = row.get('precio', 0)
-            if pd.notna(precio):
-                try:
-                    product['precio'] = float(str(precio).replace('$', '').replace(',', '').strip())
-                except ValueError:
-                    product['precio'] = 0
-            else:
-                product['precio'] = 0
-            
-            # Optional: tienda_id
-            tienda = row.get('tienda_id', '')
-            if pd.notna(tienda):
-                product['tienda_id'] = str(tienda).strip()
-            
-            # Optional: codigo
-            codigo = row.get('codigo', '')
-            if pd.notna(codigo):
-                product['codigo'] = str(codigo).strip()
-            
-            # Optional: categoria
-            categoria = row.get('categoria', '')
-            if pd.notna(categoria):
-                product['categoria'] = str(categoria).strip()
-            
-            # Optional: presentacion
-            presentacion = row.get('presentacion', '')
-            if pd.notna(presentacion):
-                product['presentacion'] = str(presentacion).strip()
-            
-            products.append(product)
-        
         metadata = {
             "filename": filename,
             "format": "tabular",
-            "total_products": len(products),
             "columns_found": list(df.columns),
             "columns_mapped": column_map
         }
         
-        return products, metadata
+        return self._iter_dataframe_products(df), metadata
+    
+    def _iter_dataframe_products(self, df: pd.DataFrame) -> Iterator[Dict[str, Any]]:
+        """
+        Convert the (renamed) DataFrame rows to product dicts.
+        Columns are cleaned with vectorized ops up front; the dicts are then
+        built lazily from plain lists, one row at a time.
+        """
+        # Required: nombre (rows without one are dropped)
+        nombre = df['nombre']
+        nombres = nombre.astype(str).str.strip()
+        keep = (nombre.notna() & (nombres != '')).to_numpy()
+        df = df[keep]
+        nombres = nombres[keep].str.upper().tolist()
+        
+        # Optional: precio (0 when missing or unparseable)
+        if 'precio' in df.columns:
+            precio = df['precio']
+            if pd.api.types.is_numeric_dtype(precio) and not pd.api.types.is_bool_dtype(precio):
+                precios = precio.astype(float).fillna(0).tolist()
+            else:
+                precios = self._column_to_prices(precio).tolist()
+        else:
+            precios = [0.0] * len(nombres)
+        
+        # Optional text fields: absent when the cell is empty, '' when the column is missing
+        optional = []
+        for key in ('tienda_id', 'codigo', 'categoria', 'presentacion'):
+            if key in df.columns:
+                col = df[key]
+                values = col.astype(str).str.strip().where(col.notna(), None).tolist()
+            else:
+                values = None
+            optional.append((key, values))
+        
+        for i, nombre in enumerate(nombres):
+            product = {'nombre': nombre, 'precio': precios[i]}
+            for key, values in optional:
+                if values is None:
+                    product[key] = ''
+                elif (value := values[i]) is not None:
+                    product[key] = value
+            
+            yield product
+    
+    @staticmethod
+    def _column_to_prices(column: pd.Series) -> pd.Series:
+        """
+        Parse a text price column like '$1,234.50' in one pass
+        (0 when empty or not a number; missing cells become 'nan'/'None').
+        """
+        text = column.astype(str).str.replace('$', '', regex=False).str.replace(',', '', regex=False)
+        return pd.to_numeric(text.str.strip(), errors='coerce').fillna(0.0).astype(float)
     
     def _map_row_to_product(
         self, 
@@ -355,21 +618,31 @@ class FileProcessor:
         
         row_dict = dict(zip(headers, values))
         
-        # Map columns
+        # Map columns: per standardized name, the non-empty value of its highest-priority alias
+        best = {}
+        for col_name, raw in row_dict.items():
+            entry = self.ALIAS_TO_STANDARD.get(col_name)
+            if entry is None or not raw:
+                continue
+            value = str(raw).strip()
+            if not value:
+                continue
+            standard_name, rank = entry
+            if standard_name not in best or rank < best[standard_name][0]:
+                best[standard_name] = (rank, value)
+        
         product = {}
-        for standard_name, possible_names in self.COLUMN_MAPPINGS.items():
-            for col_name in possible_names:
-                if col_name in row_dict and row_dict[col_name]:
-                    value = str(row_dict[col_name]).strip()
-                    if value:
-                        if standard_name == 'precio':
-                            try:
-                                product[standard_name] = float(value.replace('$', '').replace(',', ''))
-                            except ValueError:
-                                pass
-                        else:
-                            product[standard_name] = value.upper() if standard_name == 'nombre' else value
-                        break
+        for standard_name in self.COLUMN_MAPPINGS:
+            if standard_name not in best:
+                continue
+            value = best[standard_name][1]
+            if standard_name == 'precio':
+                try:
+                    product[standard_name] = float(value.replace('$', '').replace(',', ''))
+                except ValueError:
+                    pass
+            else:
+                product[standard_name] = value.upper() if standard_name == 'nombre' else value
         
         return product if product.get('nombre') else None
     
@@ -380,20 +653,15 @@ class FileProcessor:
         """
         products = []
         
-        # Pattern: Product name followed by price
-        patterns = [
-            r'(.+?)\s*[-:]\s*\$?(\d+\.?\d*)',
-            r'(.+?)\s+\$(\d+\.?\d*)',
-        ]
-        
         lines = text.split('\n')
         for line in lines:
             line = line.strip()
-            if not line:
+            # Neither pattern can match without a separator or a '$'
+            if not line or ('-' not in line and ':' not in line and '$' not in line):
                 continue
             
-            for pattern in patterns:
-                match = re.search(pattern, line)
+            for pattern in _TEXT_PRICE_PATTERNS:
+                match = pattern.match(line)
                 if match:
                     nombre = match.group(1).strip().upper()
                     try:
@@ -412,8 +680,8 @@ class FileProcessor:
     
     def get_preview_data(
         self, 
-        products: List[Dict[str, Any]], 
+        products: Iterable[Dict[str, Any]], 
         limit: int = 100
     ) -> List[Dict[str, Any]]:
-        """Get preview data for display"""
-        return products[:limit]
+        """Get preview data for display (stops consuming after `limit` products)"""
+        return list(islice(products, limit))
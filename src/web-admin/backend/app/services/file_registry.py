@@ -0,0 +1,138 @@
+"""
+File registry for the Web Admin.
+Persists uploaded file metadata in a local SQLite database (WAL mode).
+"""
+import json
+import logging
+import os
+import sqlite3
+from typing import List, Dict, Any, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    file_id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    content_type TEXT NOT NULL,
+    products_count INTEGER NOT NULL DEFAULT 0,
+    uploaded_at TEXT NOT NULL,
+    status TEXT NOT NULL,
+    metadata TEXT
+)
+"""
+
+_COLUMNS = (
+    "file_id", "filename", "size", "content_type",
+    "products_count", "uploaded_at", "status", "metadata"
+)
+
+# Upsert keeps the original rowid, so listing order stays the upload order
+_UPSERT = (
+    f"INSERT INTO files ({', '.join(_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(_COLUMNS))}) "
+    f"ON CONFLICT(file_id) DO UPDATE SET "
+    + ", ".join(f"{col} = excluded.{col}" for col in _COLUMNS[1:])
+)
+
+
+class FileRegistry:
+    """
+    Durable registry of uploaded files.
+    Every query is a primary-key lookup or a scan of a small table, so
+    calls run directly on the event loop thread.
+    """
+    
+    def __init__(self, db_path: str = settings.REGISTRY_DB_PATH):
+        """
+        Open (or create) the registry database.
+        
+        Args:
+            db_path: SQLite database file
+        """
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(_SCHEMA)
+        self.conn.commit()
+        
+        logger.info(f"✅ FileRegistry initialized ({db_path}, {self._count()} files)")
+    
+    def close(self):
+        """Close the database connection"""
+        self.conn.close()
+    
+    def _count(self) -> int:
+        """Number of rows in the files table"""
+        return self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+    
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        """Convert a row to the dict shape returned by the API"""
+        info = dict(row)
+        metadata = info.pop("metadata")
+        if metadata is not None:
+            info["metadata"] = json.loads(metadata)
+        return info
+    
+    @staticmethod
+    def _to_values(file_info: Dict[str, Any]) -> tuple:
+        """Column values for a file entry (metadata stored as JSON)"""
+        metadata = file_info.get("metadata")
+        return (
+            file_info["file_id"],
+            file_info["filename"],
+            file_info.get("size", 0),
+            file_info["content_type"],
+            file_info.get("products_count", 0),
+            file_info["uploaded_at"],
+            file_info["status"],
+            json.dumps(metadata) if metadata is not None else None
+        )
+    
+    async def put(self, file_info: Dict[str, Any]):
+        """Insert or update a file entry"""
+        await self.put_many([file_info])
+    
+    async def put_many(self, files: List[Dict[str, Any]]):
+        """Insert or update several file entries in one transaction"""
+        with self.conn:
+            self.conn.executemany(_UPSERT, [self._to_values(f) for f in files])
+    
+    async def get(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """Get a file entry, None if unknown"""
+        row = self.conn.execute(
+            "SELECT * FROM files WHERE file_id = ?", (file_id,)
+        ).fetchone()
+        return self._row_to_dict(row) if row is not None else None
+    
+    async def list_all(self) -> List[Dict[str, Any]]:
+        """Get all file entries, oldest upload first"""
+        rows = self.conn.execute("SELECT * FROM files ORDER BY rowid").fetchall()
+        return [self._row_to_dict(row) for row in rows]
+    
+    async def count(self) -> int:
+        """Number of registered files"""
+        return self._count()
+    
+    async def delete(self, file_id: str) -> bool:
+        """Remove a file entry. Returns True if it existed"""
+        with self.conn:
+            cursor = self.conn.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+        return cursor.rowcount > 0
+    
+    async def update_counts(self, counts: Dict[str, int]):
+        """Store refreshed product counts ({file_id: count})"""
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE files SET products_count = ? WHERE file_id = ?",
+                [(count, file_id) for file_id, count in counts.items()]
+            )
@@ -1,6 +1,7 @@
 """
 MinIO service for file storage
 """
+import asyncio
 import logging
 import time
 from typing import BinaryIO, List, Optional
@@ -8,15 +9,23 @@ from datetime import timedelta
 import io
 
 from minio import Minio
+from minio.deleteobjects import DeleteObject
 from minio.error import S3Error
 
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Buckets already verified/created by this process
+_checked_buckets = set()
+
 
 class MinIOService:
-    """Service for file storage in MinIO"""
+    """
+    Service for file storage in MinIO.
+    The minio client is synchronous, so every S3 request runs in a
+    worker thread to keep the event loop free.
+    """
     
     def __init__(self, max_retries: int = 10, retry_delay: int = 3):
         """
@@ -52,11 +61,14 @@ class MinIOService:
                     raise
     
     def _ensure_bucket(self):
-        """Create bucket if it doesn't exist"""
+        """Create bucket if it doesn't exist (checked once per process)"""
+        if self.bucket in _checked_buckets:
+            return
         try:
             if not self.client.bucket_exists(self.bucket):
                 self.client.make_bucket(self.bucket)
                 logger.info(f"Created bucket: {self.bucket}")
+            _checked_buckets.add(self.bucket)
         except S3Error as e:
             logger.error(f"Error creating bucket: {e}")
             raise
@@ -76,7 +88,37 @@ class MinIOService:
             file_data: File content as bytes
             filename: Original filename
             content_type: MIME type
-            
+        
+        Returns:
+            Dict with file metadata
+        """
+        return await self.upload_stream(
+            file_id=file_id,
+            stream=io.BytesIO(file_data),
+            length=len(file_data),
+            filename=filename,
+            content_type=content_type
+        )
+    
+    async def upload_stream(
+        self,
+        file_id: str,
+        stream: BinaryIO,
+        length: int,
+        filename: str,
+        content_type: str
+    ) -> dict:
+        """
+        Upload a file-like object to MinIO without loading it into memory.
+        The blocking upload runs in a worker thread, sent in 8 MB parts.
+        
+        Args:
+            file_id: Unique identifier for the file
+            stream: Readable binary stream, positioned at the start
+            length: Number of bytes to upload
+            filename: Original filename
+            content_type: MIME type
+        
         Returns:
             Dict with file metadata
         """
@@ -84,12 +126,14 @@ class MinIOService:
         
         try:
             # Upload file
-            self.client.put_object(
+            await asyncio.to_thread(
+                self.client.put_object,
                 bucket_name=self.bucket,
                 object_name=object_name,
-                data=io.BytesIO(file_data),
-                length=len(file_data),
-                content_type=content_type
+                data=stream,
+                length=length,
+                content_type=content_type,
+                part_size=8 * 1024 * 1024
             )
             
             logger.info(f"Uploaded file: {object_name}")
@@ -98,10 +142,10 @@ class MinIOService:
                 "file_id": file_id,
                 "filename": filename,
                 "object_name": object_name,
-                "size": len(file_data),
+                "size": length,
                 "content_type": content_type
             }
-            
+        
         except S3Error as e:
             logger.error(f"Error uploading file: {e}")
             raise
@@ -113,22 +157,27 @@ class MinIOService:
         Args:
             file_id: File identifier
             filename: Filename
-            
+        
         Returns:
             File content as bytes
         """
         object_name = f"{file_id}/{filename}"
         
         try:
-            response = self.client.get_object(self.bucket, object_name)
-            data = response.read()
-            response.close()
-            response.release_conn()
-            return data
+            return await asyncio.to_thread(self._read_object, object_name)
         except S3Error as e:
             logger.error(f"Error downloading file: {e}")
             raise
     
+    def _read_object(self, object_name: str) -> bytes:
+        """Fetch an object's content (blocking)"""
+        response = self.client.get_object(self.bucket, object_name)
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+    
     async def delete_file(self, file_id: str, filename: str) -> bool:
         """
         Delete a file from MinIO.
@@ -136,14 +185,14 @@ class MinIOService:
         Args:
             file_id: File identifier
             filename: Filename
-            
+        
         Returns:
             True if deleted successfully
         """
         object_name = f"{file_id}/{filename}"
         
         try:
-            self.client.remove_object(self.bucket, object_name)
+            await asyncio.to_thread(self.client.remove_object, self.bucket, object_name)
             logger.info(f"Deleted file: {object_name}")
             return True
         except S3Error as e:
@@ -156,22 +205,32 @@ class MinIOService:
         
         Args:
             file_id: File identifier (folder prefix)
-            
+        
         Returns:
             Number of files deleted
         """
         try:
-            objects = self.client.list_objects(self.bucket, prefix=f"{file_id}/")
-            count = 0
-            for obj in objects:
-                self.client.remove_object(self.bucket, obj.object_name)
-                count += 1
+            count = await asyncio.to_thread(self._delete_prefix, f"{file_id}/")
             logger.info(f"Deleted {count} files from folder: {file_id}")
             return count
         except S3Error as e:
             logger.error(f"Error deleting folder: {e}")
             return 0
     
+    def _delete_prefix(self, prefix: str) -> int:
+        """Delete every object under a prefix (blocking). Returns the number deleted"""
+        names = [
+            obj.object_name
+            for obj in self.client.list_objects(self.bucket, prefix=prefix, recursive=True)
+        ]
+        # Multi-object delete: one request per 1000 keys (lazy, so consume it)
+        errors = list(self.client.remove_objects(
+            self.bucket, (DeleteObject(name) for name in names)
+        ))
+        for error in errors:
+            logger.error(f"Error deleting {error.name}: {error.message}")
+        return len(names) - len(errors)
+    
     async def get_presigned_url(
         self, 
         file_id: str, 
@@ -185,14 +244,15 @@ class MinIOService:
             file_id: File identifier
             filename: Filename
             expires: URL expiration in seconds
-            
+        
         Returns:
             Presigned URL string
         """
         object_name = f"{file_id}/{filename}"
         
         try:
-            url = self.client.presigned_get_object(
+            url = await asyncio.to_thread(
+                self.client.presigned_get_object,
                 self.bucket,
                 object_name,
                 expires=timedelta(seconds=expires)
@@ -208,30 +268,33 @@ class MinIOService:
         
         Args:
             prefix: Optional prefix to filter files
-            
+        
         Returns:
             List of file metadata dicts
         """
         try:
-            objects = self.client.list_objects(self.bucket, prefix=prefix, recursive=True)
-            files = []
-            for obj in objects:
-                files.append({
-                    "object_name": obj.object_name,
-                    "size": obj.size,
-                    "last_modified": obj.last_modified.isoformat() if obj.last_modified else None,
-                    "etag": obj.etag
-                })
-            return files
+            return await asyncio.to_thread(self._list_objects, prefix)
         except S3Error as e:
             logger.error(f"Error listing files: {e}")
             return []
     
+    def _list_objects(self, prefix: str) -> List[dict]:
+        """List object metadata under a prefix (blocking, pages through the listing)"""
+        return [
+            {
+                "object_name": obj.object_name,
+                "size": obj.size,
+                "last_modified": obj.last_modified.isoformat() if obj.last_modified else None,
+                "etag": obj.etag
+            }
+            for obj in self.client.list_objects(self.bucket, prefix=prefix, recursive=True)
+        ]
+    
     async def file_exists(self, file_id: str, filename: str) -> bool:
         """Check if a file exists"""
         object_name = f"{file_id}/{filename}"
         try:
-            self.client.stat_object(self.bucket, object_name)
+            await asyncio.to_thread(self.client.stat_object, self.bucket, object_name)
             return True
         except S3Error:
             return False
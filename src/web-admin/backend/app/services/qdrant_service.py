@@ -2,39 +2,175 @@
 Qdrant service for the Web Admin.
 Manages product indexing and deletion.
 """
+import asyncio
+import hashlib
 import logging
+import threading
 import time
-from typing import List, Dict, Any, Optional
+import uuid
+from typing import Iterator, List, Dict, Any, Optional
 
-from qdrant_client import QdrantClient
+import numpy as np
+from cachetools import LRUCache
+from qdrant_client import AsyncQdrantClient, QdrantClient
 from qdrant_client.http import models
 from qdrant_client.http.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue
 
 from app.config import settings
+from app.services.embedding_cache import EmbeddingCache
 
 logger = logging.getLogger(__name__)
 
-# Lazy load embedding model
+# Keep the long-lived gRPC channel alive between requests instead of reconnecting
+_GRPC_OPTIONS = {
+    "grpc.keepalive_time_ms": 30000,
+    "grpc.keepalive_timeout_ms": 10000,
+    "grpc.http2.max_pings_without_data": 0,
+}
+
+# Lazy load embedding model (first use may come from several worker threads)
+_MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"
 _embedding_model = None
+_embedding_model_lock = threading.Lock()
 _embedding_dim = 384
 
+# Qdrant's default indexing_threshold (KB of vectors before a segment gets an HNSW index)
+_DEFAULT_INDEXING_THRESHOLD = 20000
+
+# indexing_threshold while a bulk load runs: no segment gets this large, so nothing
+# is indexed. Unlike 0, which an operator may set on purpose, it marks a paused load
+_PAUSED_INDEXING_THRESHOLD = 2**31 - 1
+
+# Upper bound on distinct files returned by a file_id facet
+_MAX_FILES = 100_000
+
+# Names per forward pass (encode() already groups names of similar length,
+# so larger batches add little padding)
+_ENCODE_BATCH_SIZE = 64
+
+
+class OnnxEmbeddingModel:
+    """
+    The embedding model exported to ONNX, run with ONNX Runtime.
+    Mirrors the parts of SentenceTransformer used here: mean pooling over
+    the token embeddings, optional L2 normalization.
+    """
+    
+    MAX_SEQ_LENGTH = 128
+    
+    def __init__(self, path: str, file_name: str = "model.onnx", threads: int = 0):
+        """
+        Load an `optimum-cli export onnx` output directory.
+        
+        Args:
+            path: Directory with the ONNX graph and the tokenizer files
+            file_name: Graph to load (e.g. the INT8-quantized one)
+            threads: Intra-op threads (0 = ONNX Runtime default)
+        """
+        import onnxruntime
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+        
+        session_options = onnxruntime.SessionOptions()
+        if threads > 0:
+            session_options.intra_op_num_threads = threads
+        
+        self.tokenizer = AutoTokenizer.from_pretrained(path)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            path,
+            file_name=file_name,
+            provider="CPUExecutionProvider",
+            session_options=session_options
+        )
+        self.dim = self.model.config.hidden_size
+    
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+    
+    def encode(
+        self,
+        sentences: List[str],
+        batch_size: int = 32,
+        normalize_embeddings: bool = False,
+        **kwargs
+    ) -> np.ndarray:
+        """Embed sentences as a float32 array (batches of similar length, like SentenceTransformer)"""
+        order = np.argsort([-len(s) for s in sentences], kind="stable")
+        embeddings = np.empty((len(sentences), self.dim), dtype=np.float32)
+        
+        for start in range(0, len(sentences), batch_size):
+            rows = order[start:start + batch_size]
+            inputs = self.tokenizer(
+                [sentences[i] for i in rows],
+                padding=True,
+                truncation=True,
+                max_length=self.MAX_SEQ_LENGTH,
+                return_tensors="np"
+            )
+            hidden = self.model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            embeddings[rows] = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        
+        if normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings
+
 
 def get_embedding_model():
-    """Lazy load the embedding model"""
+    """Lazy load the embedding model (ONNX Runtime if EMBEDDING_ONNX_PATH is set)"""
     global _embedding_model, _embedding_dim
     if _embedding_model is None:
-        from sentence_transformers import SentenceTransformer
-        logger.info("Loading embedding model: paraphrase-multilingual-MiniLM-L12-v2")
-        _embedding_model = SentenceTransformer("paraphrase-multilingual-MiniLM-L12-v2")
-        _embedding_dim = _embedding_model.get_sentence_embedding_dimension()
-        logger.info(f"✅ Embedding model loaded (dim={_embedding_dim})")
+        with _embedding_model_lock:
+            if _embedding_model is None:
+                if settings.EMBEDDING_ONNX_PATH:
+                    try:
+                        import optimum.onnxruntime  # noqa: F401
+                    except ImportError:
+                        raise RuntimeError(
+                            "EMBEDDING_ONNX_PATH is set but ONNX Runtime support is not installed "
+                            "(pip install -r requirements-onnx.txt, or build the image with WITH_ONNX=true)"
+                        ) from None
+                    
+                    logger.info(f"Loading ONNX embedding model: {settings.EMBEDDING_ONNX_PATH}/{settings.EMBEDDING_ONNX_FILE}")
+                    model = OnnxEmbeddingModel(
+                        settings.EMBEDDING_ONNX_PATH,
+                        settings.EMBEDDING_ONNX_FILE,
+                        threads=settings.EMBEDDING_THREADS
+                    )
+                else:
+                    import torch
+                    from sentence_transformers import SentenceTransformer
+                    
+                    # Pin intra-op threads so the encoder doesn't oversubscribe the CPU
+                    if settings.EMBEDDING_THREADS > 0:
+                        torch.set_num_threads(settings.EMBEDDING_THREADS)
+                    
+                    logger.info(f"Loading embedding model: {_MODEL_NAME}")
+                    model = SentenceTransformer(_MODEL_NAME)
+                    if settings.EMBEDDING_TORCH_COMPILE:
+                        # dynamic=True: batch shapes vary with name length, avoid recompiling per shape
+                        model[0].auto_model = torch.compile(model[0].auto_model, dynamic=True)
+                        logger.info("Embedding encoder wrapped with torch.compile")
+                # Publish the model last, once its dimension is known
+                _embedding_dim = model.get_sentence_embedding_dimension()
+                _embedding_model = model
+                logger.info(f"✅ Embedding model loaded (dim={_embedding_dim})")
     return _embedding_model
 
 
+def embedding_model_id() -> str:
+    """Identifies the configured encoder (different graphs give different vectors)"""
+    if settings.EMBEDDING_ONNX_PATH:
+        return f"onnx:{settings.EMBEDDING_ONNX_PATH}/{settings.EMBEDDING_ONNX_FILE}"
+    return _MODEL_NAME
+
+
 class QdrantAdminService:
     """
     Service for managing products in Qdrant vector database.
     Used by the Web Admin for indexing and deletion.
+    Built once at startup; every request shares its AsyncQdrantClient
+    (one long-lived gRPC channel).
     """
     
     COLLECTION_NAME = "products"
@@ -42,22 +178,53 @@ class QdrantAdminService:
     def __init__(self, max_retries: int = 10, retry_delay: int = 3):
         """
         Initialize Qdrant client with retry logic.
+        Startup (collection check/creation) uses a short-lived sync client;
+        requests go through the shared async client.
         
         Args:
             max_retries: Maximum connection attempts
             retry_delay: Seconds to wait between retries
         """
-        self.client = None
+        self.aclient = None
+        
+        # LRU cache: digest of the normalized name -> embedding (re-uploads repeat names)
+        self._embedding_cache: LRUCache = LRUCache(maxsize=max(settings.EMBEDDING_CACHE_SIZE, 1))
+        self._embedding_cache_enabled = settings.EMBEDDING_CACHE_SIZE > 0
+        self._embedding_cache_lock = threading.Lock()  # Encoding runs in worker threads
+        
+        # Second level: embeddings persisted across restarts
+        self._embedding_store = (
+            EmbeddingCache(embedding_model_id()) if settings.EMBEDDING_CACHE_DB_PATH else None
+        )
+        
+        # Uploads currently loading with HNSW indexing paused (see begin_bulk_load)
+        self._bulk_loads = 0
+        self._resume_indexing_threshold = _DEFAULT_INDEXING_THRESHOLD
         
         for attempt in range(max_retries):
             try:
                 logger.info(f"Connecting to Qdrant at {settings.QDRANT_HOST}:{settings.QDRANT_PORT} (attempt {attempt + 1}/{max_retries})")
-                self.client = QdrantClient(
+                client = QdrantClient(
                     host=settings.QDRANT_HOST,
                     port=settings.QDRANT_PORT,
+                    grpc_port=settings.QDRANT_GRPC_PORT,
+                    prefer_grpc=settings.QDRANT_PREFER_GRPC,
+                    grpc_options=_GRPC_OPTIONS,
+                    timeout=60
+                )
+                try:
+                    self._ensure_collection(client)
+                finally:
+                    client.close()
+                # Shared async client: requests never block the loop, batches run concurrently
+                self.aclient = AsyncQdrantClient(
+                    host=settings.QDRANT_HOST,
+                    port=settings.QDRANT_PORT,
+                    grpc_port=settings.QDRANT_GRPC_PORT,
+                    prefer_grpc=settings.QDRANT_PREFER_GRPC,
+                    grpc_options=_GRPC_OPTIONS,
                     timeout=60
                 )
-                self._ensure_collection()
                 logger.info(f"✅ QdrantAdminService initialized")
                 return
             except Exception as e:
@@ -69,11 +236,27 @@ class QdrantAdminService:
                     logger.error(f"Failed to connect to Qdrant after {max_retries} attempts")
                     raise
     
-    def _ensure_collection(self):
+    async def close(self):
+        """Close the Qdrant connections"""
+        if self.aclient is not None:
+            await self.aclient.close()
+        if self._embedding_store is not None:
+            self._embedding_store.close()
+    
+    def warm_up(self):
+        """
+        Load the embedding model and run one encode, so the first upload
+        doesn't pay for loading weights and allocating inference buffers.
+        Blocking: run it in a worker thread.
+        """
+        get_embedding_model().encode(["warmup"], show_progress_bar=False)
+        logger.info("✅ Embedding model warmed up")
+    
+    def _ensure_collection(self, client: QdrantClient):
         """Create collection if it doesn't exist"""
         global _embedding_dim
         
-        collections = self.client.get_collections().collections
+        collections = client.get_collections().collections
         collection_names = [c.name for c in collections]
         
         if self.COLLECTION_NAME not in collection_names:
@@ -81,70 +264,164 @@ class QdrantAdminService:
             get_embedding_model()
             
             logger.info(f"Creating collection: {self.COLLECTION_NAME}")
-            self.client.create_collection(
+            client.create_collection(
                 collection_name=self.COLLECTION_NAME,
                 vectors_config=VectorParams(
                     size=_embedding_dim,
-                    distance=Distance.COSINE
-                )
+                    distance=Distance.DOT,  # Vectors are L2-normalized, so dot == cosine
+                    on_disk=True  # Originals on disk, only read when rescoring
+                ),
+                # INT8 scalar quantization: ~4x less RAM for the index, originals kept for rescoring
+                quantization_config=models.ScalarQuantization(
+                    scalar=models.ScalarQuantizationConfig(
+                        type=models.ScalarType.INT8,
+                        quantile=0.99,
+                        always_ram=True
+                    )
+                ),
+                # Keep the HNSW graph in RAM for the ANN walk
+                hnsw_config=models.HnswConfigDiff(on_disk=False)
             )
             
             # Create payload indexes
-            self.client.create_payload_index(
+            client.create_payload_index(
                 collection_name=self.COLLECTION_NAME,
                 field_name="tienda_id",
                 field_schema="keyword"
             )
-            self.client.create_payload_index(
+            client.create_payload_index(
                 collection_name=self.COLLECTION_NAME,
                 field_name="file_id",
                 field_schema="keyword"
             )
             logger.info(f"✅ Collection '{self.COLLECTION_NAME}' created")
+        
+        # A bulk load interrupted by a restart leaves indexing paused: resume it
+        # (the threshold it replaced is lost, so Qdrant's default is used)
+        optimizer_config = client.get_collection(self.COLLECTION_NAME).config.optimizer_config
+        if optimizer_config.indexing_threshold == _PAUSED_INDEXING_THRESHOLD:
+            logger.warning("HNSW indexing was left paused by a bulk load, restoring it")
+            client.update_collection(
+                collection_name=self.COLLECTION_NAME,
+                optimizers_config=models.OptimizersConfigDiff(
+                    indexing_threshold=_DEFAULT_INDEXING_THRESHOLD
+                )
+            )
+    
+    async def _get_indexing_threshold(self) -> int:
+        """
+        The collection's indexing_threshold, to restore after a bulk load.
+        Falls back to Qdrant's default when it can't be read or is already
+        paused by another load.
+        """
+        try:
+            info = await self.aclient.get_collection(self.COLLECTION_NAME)
+            threshold = info.config.optimizer_config.indexing_threshold
+        except Exception as e:
+            logger.warning(f"Could not read indexing_threshold: {e}")
+            return _DEFAULT_INDEXING_THRESHOLD
+        
+        if threshold is None or threshold == _PAUSED_INDEXING_THRESHOLD:
+            return _DEFAULT_INDEXING_THRESHOLD
+        return threshold
+    
+    async def _set_indexing_threshold(self, threshold: int):
+        """Change the collection's indexing_threshold"""
+        try:
+            await self.aclient.update_collection(
+                collection_name=self.COLLECTION_NAME,
+                optimizers_config=models.OptimizersConfigDiff(indexing_threshold=threshold)
+            )
+        except Exception as e:
+            # Only affects load speed, never the upload itself
+            logger.warning(f"Could not set indexing_threshold={threshold}: {e}")
+    
+    async def begin_bulk_load(self):
+        """
+        Pause HNSW indexing while a large file is loaded, so the graph is
+        built once at the end instead of updated on every batch.
+        Calls are counted: indexing resumes, with the threshold the collection
+        had before, when the last load ends. The count is per process, so with
+        several web-admin replicas one replica finishing its load resumes
+        indexing while another may still be loading.
+        """
+        self._bulk_loads += 1
+        if self._bulk_loads == 1:
+            self._resume_indexing_threshold = await self._get_indexing_threshold()
+            logger.info("Pausing HNSW indexing for bulk load")
+            await self._set_indexing_threshold(_PAUSED_INDEXING_THRESHOLD)
+    
+    async def end_bulk_load(self):
+        """Finish a bulk load started with begin_bulk_load (always call it, e.g. in finally)"""
+        self._bulk_loads -= 1
+        if self._bulk_loads == 0:
+            logger.info("Resuming HNSW indexing")
+            await self._set_indexing_threshold(self._resume_indexing_threshold)
     
     def _generate_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """Generate embeddings for texts"""
+        """
+        Generate embeddings for texts.
+        Names seen before are served from the LRU cache, then from the
+        on-disk cache; only the remaining (deduplicated) names go through
+        the model.
+        """
         model = get_embedding_model()
         
         # Normalize texts
         normalized = [t.upper().strip() if t else "" for t in texts]
+        keys = [hashlib.blake2b(t.encode(), digest_size=16).digest() for t in normalized]
+        
+        embeddings = np.empty((len(normalized), _embedding_dim), dtype=np.float32)
+        missing: Dict[bytes, List[int]] = {}
+        with self._embedding_cache_lock:
+            for i, key in enumerate(keys):
+                cached = self._embedding_cache.get(key)
+                if cached is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    embeddings[i] = cached
+        
+        if missing and self._embedding_store is not None:
+            stored = self._embedding_store.get_many(list(missing))
+            for key, embedding in stored.items():
+                embeddings[missing.pop(key)] = embedding
+            if stored and self._embedding_cache_enabled:
+                with self._embedding_cache_lock:
+                    for key, embedding in stored.items():
+                        self._embedding_cache[key] = embedding
+        
+        if missing:
+            # Generate embeddings (unit length: the collection uses dot product)
+            encoded = model.encode(
+                [normalized[rows[0]] for rows in missing.values()],
+                batch_size=_ENCODE_BATCH_SIZE,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False
+            )
+            for rows, embedding in zip(missing.values(), encoded):
+                embeddings[rows] = embedding
+            if self._embedding_cache_enabled:
+                with self._embedding_cache_lock:
+                    for key, embedding in zip(missing, encoded):
+                        self._embedding_cache[key] = embedding.copy()
+            if self._embedding_store is not None:
+                self._embedding_store.put_many(zip(missing, encoded))
         
-        # Generate embeddings
-        embeddings = model.encode(normalized, convert_to_numpy=True, show_progress_bar=False)
         return embeddings.tolist()
     
-    async def index_products(
+    def _iter_points(
         self,
         products: List[Dict[str, Any]],
-        file_id: str
-    ) -> Dict[str, Any]:
-        """
-        Index products into Qdrant.
-        
-        Args:
-            products: List of product dicts
-            file_id: Source file ID for tracking
-            
-        Returns:
-            Indexing statistics
-        """
-        if not products:
-            return {"indexed": 0, "errors": 0}
-        
-        # Extract names for embedding
-        names = [p.get("nombre", "") for p in products]
-        
-        # Generate embeddings in batch
-        logger.info(f"Generating embeddings for {len(names)} products...")
-        embeddings = self._generate_embeddings(names)
-        
-        # Create points
-        points = []
-        errors = 0
-        
-        for i, (product, embedding) in enumerate(zip(products, embeddings)):
+        embeddings: List[List[float]],
+        file_id: str,
+        start_index: int
+    ) -> Iterator[PointStruct]:
+        """Build the points for products (rows that can't be converted are logged and skipped)"""
+        for i, (product, embedding) in enumerate(zip(products, embeddings), start_index):
             try:
-                point_id = f"{file_id}_{i}"
+                # Deterministic UUID per (file, row): Qdrant only accepts uint or UUID ids
+                point_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{file_id}/{i}"))
                 
                 payload = {
                     "nombre": product.get("nombre", ""),
@@ -156,30 +433,77 @@ class QdrantAdminService:
                     "file_id": file_id
                 }
                 
-                points.append(PointStruct(
+                yield PointStruct(
                     id=point_id,
                     vector=embedding,
                     payload=payload
-                ))
+                )
             except Exception as e:
                 logger.error(f"Error creating point {i}: {e}")
-                errors += 1
+    
+    async def index_products(
+        self,
+        products: List[Dict[str, Any]],
+        file_id: str,
+        start_index: int = 0,
+        batch_size: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Index products into Qdrant.
         
-        # Upsert in batches
-        batch_size = 100
-        indexed = 0
+        Args:
+            products: List of product dicts
+            file_id: Source file ID for tracking
+            start_index: Row number of the first product in the file (when
+                a file is indexed in several batches)
+            batch_size: Points per upsert request (default: QDRANT_UPSERT_BATCH_SIZE)
         
-        for i in range(0, len(points), batch_size):
-            batch = points[i:i + batch_size]
-            try:
-                self.client.upsert(
+        Returns:
+            Indexing statistics
+        """
+        if not products:
+            return {"indexed": 0, "errors": 0}
+        
+        batch_size = batch_size or settings.QDRANT_UPSERT_BATCH_SIZE
+        semaphore = asyncio.Semaphore(settings.QDRANT_UPSERT_CONCURRENCY)
+        
+        async def _upsert(batch: List[PointStruct]):
+            async with semaphore:
+                # wait=False: acknowledged once queued, not after the segment is updated
+                await self.aclient.upsert(
                     collection_name=self.COLLECTION_NAME,
-                    points=batch
+                    points=batch,
+                    wait=False
                 )
-                indexed += len(batch)
-            except Exception as e:
-                logger.error(f"Error upserting batch {i}: {e}")
-                errors += len(batch)
+        
+        # Encode one upsert batch at a time in a worker thread; the batches
+        # already encoded upload meanwhile (CPU and network overlap)
+        logger.info(f"Generating embeddings for {len(products)} products...")
+        errors = 0
+        sizes = []
+        tasks = []
+        try:
+            for offset in range(0, len(products), batch_size):
+                chunk = products[offset:offset + batch_size]
+                names = [p.get("nombre", "") for p in chunk]
+                embeddings = await asyncio.to_thread(self._generate_embeddings, names)
+                
+                points = list(self._iter_points(chunk, embeddings, file_id, start_index + offset))
+                errors += len(chunk) - len(points)
+                if points:
+                    sizes.append(len(points))
+                    tasks.append(asyncio.create_task(_upsert(points)))
+        finally:
+            # Never leave upserts running behind the caller (e.g. its cleanup delete)
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        
+        indexed = 0
+        for i, (size, result) in enumerate(zip(sizes, results)):
+            if isinstance(result, Exception):
+                logger.error(f"Error upserting batch {i}: {result}")
+                errors += size
+            else:
+                indexed += size
         
         logger.info(f"Indexed {indexed} products from file {file_id}")
         
@@ -189,59 +513,44 @@ class QdrantAdminService:
             "file_id": file_id
         }
     
-    async def delete_by_file(self, file_id: str) -> int:
+    async def delete_by_file(self, file_id: str) -> bool:
         """
         Delete all products from a specific file.
+        Issues a single delete request (no count round trip beforehand;
+        the registry already knows how many products the file has).
         
         Args:
             file_id: File ID to delete
-            
+        
         Returns:
-            Number of products deleted
+            True if the delete was applied
         """
-        # Count before delete
-        try:
-            count_result = self.client.count(
-                collection_name=self.COLLECTION_NAME,
-                count_filter=Filter(
-                    must=[
-                        FieldCondition(
-                            key="file_id",
-                            match=MatchValue(value=file_id)
-                        )
-                    ]
+        file_filter = Filter(
+            must=[
+                FieldCondition(
+                    key="file_id",
+                    match=MatchValue(value=file_id)
                 )
-            )
-            count_before = count_result.count
-        except Exception:
-            count_before = 0
+            ]
+        )
         
-        # Delete points
         try:
-            self.client.delete(
+            await self.aclient.delete(
                 collection_name=self.COLLECTION_NAME,
-                points_selector=models.FilterSelector(
-                    filter=Filter(
-                        must=[
-                            FieldCondition(
-                                key="file_id",
-                                match=MatchValue(value=file_id)
-                            )
-                        ]
-                    )
-                )
+                points_selector=models.FilterSelector(filter=file_filter),
+                wait=True
             )
-            logger.info(f"Deleted {count_before} products from file {file_id}")
+            logger.info(f"Deleted products from file {file_id}")
         except Exception as e:
             logger.error(f"Error deleting products: {e}")
-            return 0
+            return False
         
-        return count_before
+        return True
     
     async def get_stats(self) -> Dict[str, Any]:
         """Get collection statistics"""
         try:
-            info = self.client.get_collection(self.COLLECTION_NAME)
+            info = await self.aclient.get_collection(self.COLLECTION_NAME)
             return {
                 "total_products": info.points_count,
                 "vectors_count": info.vectors_count,
@@ -262,7 +571,7 @@ class QdrantAdminService:
     ) -> List[Dict[str, Any]]:
         """Get products indexed from a specific file"""
         try:
-            results, _ = self.client.scroll(
+            results, _ = await self.aclient.scroll(
                 collection_name=self.COLLECTION_NAME,
                 scroll_filter=Filter(
                     must=[
@@ -284,7 +593,7 @@ class QdrantAdminService:
     async def count_by_file(self, file_id: str) -> int:
         """Count products from a specific file"""
         try:
-            result = self.client.count(
+            result = await self.aclient.count(
                 collection_name=self.COLLECTION_NAME,
                 count_filter=Filter(
                     must=[
@@ -299,15 +608,98 @@ class QdrantAdminService:
         except Exception:
             return 0
     
+    async def counts_by_files(self, file_ids: List[str]) -> Dict[str, int]:
+        """
+        Count products for several files in one request.
+        
+        Uses a facet (grouped count) over the indexed file_id payload,
+        restricted to the given files. Falls back to one count per file
+        if the server doesn't support facets.
+        
+        Args:
+            file_ids: Files to count
+        
+        Returns:
+            Dict file_id -> product count (0 for files without products)
+        """
+        counts = dict.fromkeys(file_ids, 0)
+        if not file_ids:
+            return counts
+        
+        try:
+            result = await self.aclient.facet(
+                collection_name=self.COLLECTION_NAME,
+                key="file_id",
+                facet_filter=Filter(
+                    must=[
+                        FieldCondition(
+                            key="file_id",
+                            match=models.MatchAny(any=file_ids)
+                        )
+                    ]
+                ),
+                limit=len(file_ids),
+                exact=True
+            )
+            for hit in result.hits:
+                counts[hit.value] = hit.count
+        except Exception as e:
+            logger.warning(f"Facet count failed, counting per file: {e}")
+            for file_id in file_ids:
+                counts[file_id] = await self.count_by_file(file_id)
+        
+        return counts
+    
+    async def file_counts(self) -> Dict[str, int]:
+        """
+        Product count of every file in the collection, in one request.
+        
+        A single facet over the indexed file_id payload gives both the
+        distinct files and their counts. Falls back to listing the files
+        and counting them if the server doesn't support facets.
+        
+        Returns:
+            Dict file_id -> product count
+        """
+        try:
+            result = await self.aclient.facet(
+                collection_name=self.COLLECTION_NAME,
+                key="file_id",
+                limit=_MAX_FILES,
+                exact=True
+            )
+            return {hit.value: hit.count for hit in result.hits}
+        except Exception as e:
+            logger.warning(f"Facet on file_id failed, counting per file: {e}")
+        
+        return await self.counts_by_files(await self.get_unique_file_ids())
+    
     async def get_unique_file_ids(self) -> List[str]:
-        """Get list of unique file IDs in the collection"""
+        """
+        Get list of unique file IDs in the collection.
+        
+        Reads the distinct values of the indexed file_id payload (facet),
+        without touching the points. Falls back to scrolling the whole
+        collection if the server doesn't support facets.
+        """
+        try:
+            result = await self.aclient.facet(
+                collection_name=self.COLLECTION_NAME,
+                key="file_id",
+                limit=_MAX_FILES,
+                exact=True
+            )
+            return [hit.value for hit in result.hits]
+        except Exception as e:
+            logger.warning(f"Facet on file_id failed, scrolling the collection: {e}")
+        
         try:
             # Scroll through all points to get unique file_ids
             file_ids = set()
             offset = None
             
             while True:
-                results, offset = self.client.scroll(
+                results, offset = await self.aclient.scroll(
                     collection_name=self.COLLECTION_NAME,
                     limit=1000,
                     offset=offset,